@@ -0,0 +1,81 @@
+import json
+import os
+import time
+
+from twikit.errors import TooManyRequests
+
+from scheduler import RateLimited
+
+
+def load_cookies(cookie_file: str) -> dict:
+    """Load a cookie.json file as written by cookieconvert.py."""
+    with open(cookie_file, "r") as file:
+        return json.load(file)
+
+
+def account_name(cookie_file: str) -> str:
+    """Name an account after its cookie file, e.g. cookies/alice.json -> alice."""
+    return os.path.splitext(os.path.basename(cookie_file))[0]
+
+
+class Account:
+    """One twikit session plus the rate limits it has run into."""
+
+    def __init__(self, name: str, client):
+        self.name = name
+        self.client = client
+        self.limited_until = {}  # twikit method name -> unix time its rate limit resets
+
+    def available(self, method: str) -> bool:
+        return time.time() >= self.limited_until.get(method, 0)
+
+    def mark_limited(self, method: str, reset_at: float = None):
+        # Twitter's windows are 15 minutes; assume a full window if it didn't say
+        self.limited_until[method] = reset_at or time.time() + 15 * 60
+
+
+class AccountPool:
+    """Spreads read-only twikit calls across several logged-in accounts.
+
+    Each call goes to the next account (round robin) that isn't rate limited for that
+    method. An account that hits a 429, or whose scheduler refuses the call as RateLimited, is
+    skipped for that method until its window resets, and the call is retried on the next account.
+    """
+
+    def __init__(self, accounts: list):
+        if not accounts:
+            raise ValueError("AccountPool needs at least one account")
+        self.accounts = accounts
+        self._next = 0
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def pick(self, method: str, exclude=()) -> Account:
+        """The next available account for ``method``, skipping the accounts in ``exclude``."""
+        candidates = [account for account in self.accounts if account not in exclude]
+        for offset in range(len(self.accounts)):
+            account = self.accounts[(self._next + offset) % len(self.accounts)]
+            if account not in exclude and account.available(method):
+                self._next = (self._next + offset + 1) % len(self.accounts)
+                return account
+        # Everyone left is limited: use whoever frees up first and let the call fail or wait there
+        return min(candidates, key=lambda account: account.limited_until.get(method, 0))
+
+    async def call(self, method: str, *args, **kwargs):
+        """Call a twikit Client method on the best available account, trying each account at most once."""
+        tried = set()
+        while True:
+            account = self.pick(method, exclude=tried)
+            tried.add(account)
+            try:
+                return await getattr(account.client, method)(*args, **kwargs)
+            except TooManyRequests as e:
+                account.mark_limited(method, getattr(e, 'rate_limit_reset', None))
+                if len(tried) == len(self.accounts):
+                    raise
+            except RateLimited as e:
+                # The account's scheduler already knew it was out of budget and didn't call Twitter
+                account.mark_limited(method, time.time() + e.retry_after)
+                if len(tried) == len(self.accounts):
+                    raise
@@ -1,12 +1,169 @@
-from quart import Quart, request, jsonify, render_template
+from quart import Quart, request, websocket, has_websocket_context, jsonify, render_template, make_response
+from quart.json.provider import DefaultJSONProvider
+import asyncio
+import glob
+import json
+import logging
 import os
 from twitter_client import TwitterClient
+from accounts import AccountPool, account_name
+from media import MediaUploadError
+from metrics import REGISTRY, Gauge
+from scheduler import RateLimited
+from store import Store
+from twikit.errors import TooManyRequests
 from flask import send_from_directory
+import serializers
+
+
+class CompactJSONProvider(DefaultJSONProvider):
+    """Encode responses with the compact serializer instead of the indented, key-sorted default."""
+
+    def dumps(self, object_, **kwargs):
+        return serializers.dumps(object_)
+
+
+# TWEETAWAY_LOG_LEVEL=DEBUG shows per-request detail; the default only reports problems and rate limits
+logging.basicConfig(
+    level=os.environ.get("TWEETAWAY_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
 
 app = Quart(__name__)
+app.json = CompactJSONProvider(app)
+
+# The main account uses cookie.json; extra accounts go in cookies/<name>.json (same format, see cookieconvert.py)
+PRIMARY_COOKIE_FILE = "cookie.json"
+EXTRA_COOKIE_FILES = sorted(glob.glob(os.path.join("cookies", "*.json")))
+
+
+# TWEETAWAY_WRITE_BEHIND=1 answers likes, bookmarks, follows... at once and sends them to Twitter in the background
+WRITE_BEHIND = os.environ.get("TWEETAWAY_WRITE_BEHIND", "") not in ("", "0")
+
+# Largest /batch request accepted; each action is still one upstream call
+MAX_BATCH_ACTIONS = 100
+
+# Most users /resolve_users looks up at once; names we've seen before cost nothing
+MAX_RESOLVE_USERS = 200
+
+# Most conversations one /direct_messages/live connection may watch; each adds to the shared poll
+MAX_LIVE_CONVERSATIONS = 20
+
+# On-disk cache so restarts start warm; set TWEETAWAY_CACHE_DIR to an empty string to turn it off
+CACHE_DIR = os.environ.get("TWEETAWAY_CACHE_DIR", "cache")
+
+
+def load_accounts():
+    """Create a TwitterClient per cookie file, all sharing one pool for read-only lookups."""
+    clients = {}
+    for cookie_file in [PRIMARY_COOKIE_FILE] + EXTRA_COOKIE_FILES:
+        name = account_name(cookie_file)
+        store = Store(os.path.join(CACHE_DIR, f"{name}.db")) if CACHE_DIR else None
+        client = TwitterClient(cookie_file=cookie_file, store=store)
+        if WRITE_BEHIND and store is None:
+            # Queued actions would be acknowledged and then lost on restart
+            logger.error(
+                "TWEETAWAY_WRITE_BEHIND needs the on-disk cache (TWEETAWAY_CACHE_DIR); "
+                "write-behind stays off for %s", name)
+        elif WRITE_BEHIND:
+            client.enable_write_behind()
+        clients[client.account.name] = client
+    readers = AccountPool([client.account for client in clients.values()])
+    for client in clients.values():
+        client.readers = readers
+    return clients
+
+
+# Initialize a TwitterClient for every account, with the cookie.json one as the default
+accounts = load_accounts()
+twitter_client = accounts[account_name(PRIMARY_COOKIE_FILE)]
+
+
+def cache_counters():
+    counters = {}
+    for name, client in accounts.items():
+        for cache_name, cache in (('tweets', client.tweets), ('feed_pages', client.feed_pages)):
+            for counter, value in cache.stats().items():
+                counters[(name, cache_name, counter)] = value
+    return counters
+
+
+def scheduler_queues():
+    queues = {}
+    for name, client in accounts.items():
+        stats = client.scheduler.stats()
+        queues[(name, 'running')] = stats['running']
+        for level, queued in stats['queued'].items():
+            queues[(name, f'queued_{level}')] = queued
+    return queues
+
+
+REGISTRY.register(Gauge(
+    'tweetaway_cache', 'In-memory cache sizes and hit/miss/eviction counts.', ('account', 'cache', 'counter'),
+    cache_counters,
+))
+REGISTRY.register(Gauge(
+    'tweetaway_scheduler_calls', "twikit calls running or waiting in each account's scheduler.", ('account', 'state'),
+    scheduler_queues,
+))
+
+
+def requested_account():
+    """The account name from ?account=<name> or an X-Account header, or None for the default."""
+    source = websocket if has_websocket_context() else request
+    return source.args.get('account') or source.headers.get('X-Account')
+
+
+def current_client() -> TwitterClient:
+    """The account this request acts as, picked with ?account=<name> or an X-Account header."""
+    name = requested_account()
+    return accounts[name] if name else twitter_client
+
+
+@app.before_request
+@app.before_websocket
+async def reject_unknown_account():
+    """Refuse a request for an account we don't have, rather than acting as the default one."""
+    name = requested_account()
+    if name and name not in accounts:
+        return jsonify({'error': f"Unknown account: {name}"}), 404
+
+
+@app.before_serving
+async def warm_caches():
+    """Load what the previous run cached on disk before taking requests."""
+    for client in accounts.values():
+        await client.warm_from_store()
+        if client.write_queue is not None:
+            await client.write_queue.load()
+            client.write_queue.start()
+
+
+@app.after_serving
+async def close_stores():
+    for client in accounts.values():
+        if client.write_queue is not None:
+            await client.write_queue.stop()
+        if client.store is not None:
+            await client.store.close()
+
+
+def error_response(error: Exception, status: int = 500):
+    """Turn an exception into a JSON error, answering 429 with Retry-After when Twitter rate limited us."""
+    cause = error
+    while cause is not None:  # TwitterClient wraps errors in RuntimeError, so look down the chain
+        if isinstance(cause, RateLimited):
+            return jsonify({'error': str(error)}), 429, {'Retry-After': str(int(cause.retry_after) + 1)}
+        if isinstance(cause, TooManyRequests):
+            return jsonify({'error': str(error)}), 429
+        if isinstance(cause, MediaUploadError):
+            # Keyed by form field, so the client knows which images to send again
+            failures = {f'image_path{index + 1}': str(failure) for index, failure in cause.failures.items()}
+            return jsonify({'error': str(error), 'media_ids': cause.media_ids, 'failures': failures}), status
+        cause = cause.__cause__ or cause.__context__
+    return jsonify({'error': str(error)}), status
 
-# Initialize TwitterClient with the path to your cookies file
-twitter_client = TwitterClient(cookie_file="cookie.json")
 
 @app.route('/')
 async def home():
@@ -26,10 +183,10 @@ async def search_tweets():
         return jsonify({'error': 'Query parameter is required'}), 400
 
     try:
-        tweets = await twitter_client.search_tweets(query)  # Use async search method
+        tweets = await current_client().search_tweets(query)  # Use async search method
         return jsonify({'tweets': tweets})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/tweet', methods=['POST'])
 async def create_tweet():
@@ -53,10 +210,10 @@ async def create_tweet():
     try:
         image_paths = [image_path1, image_path2, image_path3, image_path4]
         alt_texts = [alt_text1, alt_text2, alt_text3, alt_text4]
-        response = await twitter_client.create_tweet(content, image_paths, alt_texts, reply_to, attachment_url)
+        response = await current_client().create_tweet(content, image_paths, alt_texts, reply_to, attachment_url)
         return jsonify({'response': response})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
     
 @app.route('/quote', methods=['POST'])
 async def quote_tweet():
@@ -79,10 +236,10 @@ async def quote_tweet():
     try:
         image_paths = [image_path1, image_path2, image_path3, image_path4]
         alt_texts = [alt_text1, alt_text2, alt_text3, alt_text4]
-        response = await twitter_client.quote_tweet(content, image_paths, alt_texts, attachment_url)
+        response = await current_client().quote_tweet(content, image_paths, alt_texts, attachment_url)
         return jsonify({'response': response})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/home_feed', methods=['GET'])
 async def home_feed():
@@ -92,10 +249,36 @@ async def home_feed():
     cursor = request.args.get('cursor', None)
 
     try:
-        feed = await twitter_client.get_home_feed(count=count, seen_tweet_ids=seen_tweet_ids, cursor=cursor)
+        feed = await current_client().get_home_feed(count=count, seen_tweet_ids=seen_tweet_ids, cursor=cursor)
         return jsonify(feed)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+    
+@app.route('/home_feed/stream', methods=['GET'])
+async def home_feed_stream():
+    """Push new home feed tweets to the browser as Server-Sent Events."""
+    client = current_client()
+    queue = client.timeline_stream.subscribe()
+
+    async def events():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"  # Stops proxies from closing an idle stream
+                    continue
+                yield f"event: tweets\ndata: {serializers.dumps(event)}\n\n".encode()
+        finally:
+            client.timeline_stream.unsubscribe(queue)
+
+    response = await make_response(events(), {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    response.timeout = None  # The stream stays open for as long as the tab does
+    return response
     
 @app.route('/bookmarks_feed', methods=['GET'])
 async def bookmarks_feed():
@@ -103,10 +286,10 @@ async def bookmarks_feed():
     count = request.args.get('count', 20, type=int)
 
     try:
-        feed = await twitter_client.get_bookmarks(count=count)
+        feed = await current_client().get_bookmarks(count=count)
         return jsonify(feed)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
     
 @app.route('/notifications_list', methods=['GET'])
 async def notifications_list():
@@ -114,150 +297,200 @@ async def notifications_list():
     count = request.args.get('count', 20, type=int)
 
     try:
-        feed = await twitter_client.get_notifications(count=count)
+        feed = await current_client().get_notifications(count=count)
         return jsonify(feed)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
     
+@app.route('/notifications/read', methods=['POST'])
+async def notifications_read():
+    """Reset the unread notification counter."""
+    try:
+        return jsonify(current_client().mark_notifications_read())
+    except Exception as e:
+        return error_response(e)
+
 @app.route('/current_user', methods=['GET'])
 async def current_user():
     """Fetch the logged-in user's profile details."""
     try:
-        current_user = await twitter_client.get_user()  # Get the profile info
+        current_user = await current_client().get_user()  # Get the profile info
         return jsonify(current_user)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
     
 @app.route('/tweet/<tweet_id>', methods=['GET'])
 async def get_tweet(tweet_id):
     """fetch a tweet with details by id"""
     try:
-        tweet = await twitter_client.get_tweet(tweet_id)
+        tweet = await current_client().get_tweet(tweet_id)
         return jsonify(tweet)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+
+async def engage(action, target, message):
+    """Perform an engagement action, or queue it when write-behind is on (202 with the queue entry)."""
+    client = current_client()
+    try:
+        if client.write_queue is not None:
+            entry = await client.write_queue.enqueue(action, target, key=request.headers.get('Idempotency-Key'))
+            return jsonify({'response': message, 'queued': entry}), 202
+        await client.perform_action(action, target)
+        return jsonify({'response': message})
+    except Exception as e:
+        return error_response(e)
 
 
 @app.route('/like/<tweet_id>', methods=['POST'])
 async def like_tweet(tweet_id):
     """Like a tweet."""
-    try:
-        await twitter_client.like_tweet(tweet_id)
-        return jsonify({'response': 'Tweet liked successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return await engage('like', tweet_id, 'Tweet liked successfully')
     
 @app.route('/bookmark/<tweet_id>', methods=['POST'])
 async def bookmark_tweet(tweet_id):
     """Bookmark a tweet."""
-    try:
-        await twitter_client.bookmark_tweet(tweet_id)
-        return jsonify({'response': 'Tweet bookmarked successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return await engage('bookmark', tweet_id, 'Tweet bookmarked successfully')
     
 @app.route('/unbookmark/<tweet_id>', methods=['POST'])
 async def unbookmark_tweet(tweet_id):
     """Delete a bookmark."""
-    try:
-        await twitter_client.unbookmark_tweet(tweet_id)
-        return jsonify({'response': 'Removed bookmark successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return await engage('unbookmark', tweet_id, 'Removed bookmark successfully')
     
 @app.route('/unlike/<tweet_id>', methods=['POST'])
 async def unlike_tweet(tweet_id):
     """Unlike a tweet."""
-    try:
-        await twitter_client.unlike_tweet(tweet_id)
-        return jsonify({'response': 'Tweet unliked successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return await engage('unlike', tweet_id, 'Tweet unliked successfully')
     
 @app.route('/follow/<user_id>', methods=['POST'])
 async def follow_user(user_id):
     """Follow a user."""
-    try:
-        await twitter_client.follow_user(user_id)
-        return jsonify({'response': 'User followed successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return await engage('follow', user_id, 'User followed successfully')
     
 @app.route('/unfollow/<user_id>', methods=['POST'])
 async def unfollow_user(user_id):
     """Unfollow a user."""
-    try:
-        await twitter_client.unfollow_user(user_id)
-        return jsonify({'response': 'User unfollowed successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return await engage('unfollow', user_id, 'User unfollowed successfully')
     
 @app.route('/block/<user_id>', methods=['POST'])
 async def block_user(user_id):
     """Block a user."""
-    try:
-        await twitter_client.block_user(user_id)
-        return jsonify({'response': 'User blocked successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return await engage('block', user_id, 'User blocked successfully')
     
 @app.route('/unblock/<user_id>', methods=['POST'])
 async def unblock_user(user_id):
     """Unblock a user."""
-    try:
-        await twitter_client.unblock_user(user_id)
-        return jsonify({'response': 'User unblocked successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return await engage('unblock', user_id, 'User unblocked successfully')
     
 @app.route('/retweet/<tweet_id>', methods=['POST'])
 async def retweet(tweet_id):
     """Retweet."""
+    return await engage('retweet', tweet_id, 'Retweeted successfully')
+    
+@app.route('/batch', methods=['POST'])
+async def batch():
+    """Run a list of actions in one request: {"actions": [{"action": "like", "id": "123"}, ...]}."""
+    data = await request.json
+    actions = (data or {}).get('actions')
+    if not isinstance(actions, list) or not actions:
+        return jsonify({'error': 'A non-empty list of actions is required'}), 400
+    if len(actions) > MAX_BATCH_ACTIONS:
+        return jsonify({'error': f'At most {MAX_BATCH_ACTIONS} actions per batch'}), 400
     try:
-        # Use the TwitterClient to reweet
-        response = await twitter_client.retweet(tweet_id)
-        return jsonify({'response': 'Retweeted successfully'})
+        results = await current_client().run_batch(actions)
+        return jsonify({'results': results})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    
+        return error_response(e)
+
+@app.route('/writes', methods=['GET'])
+async def writes():
+    """Pending, failed and recently finished write-behind actions."""
+    client = current_client()
+    if client.write_queue is None:
+        return jsonify({'error': 'Write-behind is off, set TWEETAWAY_WRITE_BEHIND=1'}), 404
+    return jsonify(client.write_queue.status())
+
+@app.route('/writes/<key>/retry', methods=['POST'])
+async def retry_write(key):
+    """Queue a failed write-behind action again."""
+    client = current_client()
+    entry = client.write_queue.retry(key) if client.write_queue is not None else None
+    if entry is None:
+        return jsonify({'error': 'No failed action with that key'}), 404
+    return jsonify(entry)
+
 @app.route('/tweet/<tweet_id>/replies')
 async def get_replies(tweet_id):
+    count = request.args.get('count', 20, type=int)
+    cursor = request.args.get('cursor')
     try:
-        replies = await twitter_client.get_replies(tweet_id)
+        replies = await current_client().get_replies(tweet_id, count=count, cursor=cursor)
         return jsonify(replies)
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return error_response(e, status=400)
     
+@app.route('/tweet/<tweet_id>/thread')
+async def get_thread(tweet_id):
+    """Fetch the whole conversation around a tweet as a tree."""
+    try:
+        return jsonify(await current_client().get_thread(tweet_id))
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/tweet/<tweet_id>/thread/stream')
+async def stream_thread(tweet_id):
+    """Send the conversation around a tweet as Server-Sent Events, one level of replies at a time."""
+    client = current_client()
+
+    async def events():
+        try:
+            async for event, data in client.stream_thread(tweet_id):
+                yield f"event: {event}\ndata: {serializers.dumps(data)}\n\n".encode()
+        except Exception as e:
+            # Not 'error': EventSource uses that name for its own connection errors
+            yield f"event: failed\ndata: {serializers.dumps({'error': str(e)})}\n\n".encode()
+
+    response = await make_response(events(), {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    response.timeout = None
+    return response
+
 @app.route('/tweet/<tweet_id>/context')
 async def get_tweet_context(tweet_id):
     """fetch a tweet with details by id"""
     try:
-        tweet = await twitter_client.get_tweet_context(tweet_id)
+        tweet = await current_client().get_tweet_context(tweet_id)
         return jsonify(tweet)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
     
 @app.route('/user_profile/<username>', methods=['GET'])
 async def user_profile(username):
     """Fetch the user's profile and their tweets."""
     try:
         # Fetch user data
-        user_data = await twitter_client.get_user_profile(username, count=10)
+        user_data = await current_client().get_user_profile(username, count=10)
 
 
         # Prepare the response
         return jsonify(user_data)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/direct_messages/<user_id>', methods=['GET'])
 async def chat_history(user_id):
-    """Fetch chat history with a specific user."""
+    """Fetch chat history with a specific user, newest first; pass next_cursor as ?before= for older messages."""
+    count = request.args.get('count', 50, type=int)
+    before = request.args.get('before')
+
     try:
-        messages = await twitter_client.get_chat_history(user_id)
-        return jsonify({'messages': messages})
+        history = await current_client().get_chat_history(user_id, before=before, count=count)
+        return jsonify(history)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/send_message/<user_id>', methods=['POST'])
 async def send_message(user_id):
@@ -267,32 +500,129 @@ async def send_message(user_id):
     if not text:
         return jsonify({'error': 'Message text is required'}), 400
     try:
-        await twitter_client.send_message(user_id, text)
-        return jsonify({'response': 'Message sent successfully'})
+        message = await current_client().send_message(user_id, text)
+        return jsonify({'response': 'Message sent successfully', 'message': message})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
     
+@app.websocket('/direct_messages/live')
+async def direct_messages_live():
+    """Push new DMs for every conversation this tab has open, over one WebSocket.
+
+    The browser sends {"action": "subscribe" | "unsubscribe", "user_id": ...} as chats open
+    and close; the server sends {"type": "messages", "user_id": ..., "messages": [...]}.
+    All tabs share one background poll of the watched conversations. Each connection may
+    watch at most MAX_LIVE_CONVERSATIONS, by numeric user ID.
+    """
+    client = current_client()
+    queue = client.dm_stream.subscribe()
+    watching = set()
+
+    async def receive():
+        while True:
+            try:
+                data = json.loads(await websocket.receive())
+                action, user_id = data['action'], str(data['user_id'])
+            except (ValueError, KeyError, TypeError):
+                await websocket.send(serializers.dumps({'type': 'error', 'error': 'Expected {"action": ..., "user_id": ...}'}))
+                continue
+            if not (user_id.isascii() and user_id.isdigit()):
+                await websocket.send(serializers.dumps({'type': 'error', 'error': 'user_id must be a numeric user ID'}))
+                continue
+            if action == 'subscribe' and user_id not in watching and len(watching) >= MAX_LIVE_CONVERSATIONS:
+                await websocket.send(serializers.dumps(
+                    {'type': 'error', 'error': f"At most {MAX_LIVE_CONVERSATIONS} conversations per connection"}))
+            elif action == 'subscribe' and user_id not in watching:
+                watching.add(user_id)
+                client.watch_conversation(user_id)
+            elif action == 'unsubscribe' and user_id in watching:
+                watching.discard(user_id)
+                client.unwatch_conversation(user_id)
+
+    async def send():
+        while True:
+            event = await queue.get()
+            if event['user_id'] in watching:
+                await websocket.send(serializers.dumps(dict(event, type='messages')))
+
+    try:
+        await asyncio.gather(receive(), send())
+    finally:
+        client.dm_stream.unsubscribe(queue)
+        for user_id in watching:
+            client.unwatch_conversation(user_id)
+
 @app.route('/get_user_id/<username>', methods=['GET'])
 async def get_user_id(username):
     """Fetch the user_id for a given username."""
     try:
-        user_id = await twitter_client.get_user_id(username)
+        user_id = await current_client().get_user_id(username)
         return jsonify({'user_id': user_id})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
     
+@app.route('/resolve_users', methods=['POST'])
+async def resolve_users():
+    """Resolve many screen names to user IDs and/or IDs to screen names: {"usernames": [...], "user_ids": [...]}."""
+    data = await request.json or {}
+    usernames = data.get('usernames') or []
+    user_ids = data.get('user_ids') or []
+    if not isinstance(usernames, list) or not isinstance(user_ids, list) or not (usernames or user_ids):
+        return jsonify({'error': 'A list of usernames and/or user_ids is required'}), 400
+    if len(usernames) + len(user_ids) > MAX_RESOLVE_USERS:
+        return jsonify({'error': f'At most {MAX_RESOLVE_USERS} users per request'}), 400
+    try:
+        return jsonify(await current_client().resolve_users(usernames=usernames, user_ids=user_ids))
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/local_search', methods=['GET'])
+async def search_local():
+    """Search tweets already seen in feeds, bookmarks, profiles and searches, without calling Twitter.
+
+    Not under /search/, where it would shadow a search for the word "local".
+    """
+    query = request.args.get('query', '')
+    if not query:
+        return jsonify({"error": "Query parameter is required"}), 400
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify(current_client().search_local(query, limit=limit))
+
 @app.route('/search/<query>', methods=['GET'])
 async def search(query):
-    """Search tweets and users using key words."""
+    """Search tweets and users using key words. Pass ?mode=hybrid to add matching tweets from the local index."""
     if not query:
         return jsonify({"error": "Query parameter is required"}), 400
+    mode = request.args.get('mode', 'remote')
+    if mode not in ('remote', 'local', 'hybrid'):
+        return jsonify({"error": "mode must be remote, local or hybrid"}), 400
     
     try:
-        search_results = await twitter_client.search_twitter(query=query)
+        search_results = await current_client().search_twitter(query=query, mode=mode)
         
         return jsonify(search_results)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+@app.route('/stats', methods=['GET'])
+async def stats():
+    """Report scheduler queues, rate-limit windows and cache counters for every account."""
+    return jsonify({
+        name: {
+            'scheduler': client.scheduler.stats(),
+            'tweet_cache': client.tweets.stats(),
+            'feed_page_cache': client.feed_pages.stats(),
+            'user_directory': client.users.stats(),
+            'following': {'size': len(client.following.ids()), 'truncated': client.following.truncated},
+            'bookmarks': {'size': len(client.bookmarks.ids()), 'truncated': client.bookmarks.truncated},
+        }
+        for name, client in accounts.items()
+    })
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Timing histograms and cache/scheduler gauges in the Prometheus text format."""
+    return REGISTRY.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8000)
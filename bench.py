@@ -0,0 +1,453 @@
+"""Benchmark TwitterClient and the app's routes against a local fake Twitter.
+
+    python bench.py --requests 500 --concurrency 50 --latency 0.08 --reply-ratio 0.4
+
+Every scenario gets a fresh TwitterClient backed by FakeTwitter, a stand-in for the
+twikit Client that answers from generated data after a configurable delay. It counts
+every call and can enforce per-method rate limits. For each scenario the report shows
+the p50/p99 latency, upstream calls per request, and the memory allocated per request
+(measured in a separate, smaller tracemalloc pass so it doesn't slow down the timed one).
+Use the same --seed to compare runs before and after a change.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from twikit.errors import TooManyRequests
+
+from scheduler import WRITE_METHODS
+from twitter_client import TwitterClient
+
+WORDS = (
+    "python async cache feed tweet reply quote thread rate limit latency bookmark follow "
+    "search index profile timeline notification message benchmark #python #asyncio @alice @bob"
+).split()
+
+
+class FakeResult(list):
+    """A page of results with twikit's Result pagination interface."""
+
+    def __init__(self, items, fetch_next=None, next_cursor=None, previous_cursor=None):
+        super().__init__(items)
+        self._fetch_next = fetch_next
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    async def next(self):
+        if self._fetch_next is None:
+            return FakeResult([])
+        return await self._fetch_next()
+
+
+class FakeUser:
+    def __init__(self, user_id: str):
+        self.id = user_id
+        self.name = f"User {user_id}"
+        self.screen_name = f"user{user_id}"
+        self.description = f"Bio of user {user_id}"
+        self.followers_count = int(user_id) * 7
+        self.following_count = int(user_id) * 3
+        self.profile_image_url = f"https://example.invalid/{user_id}.jpg"
+        self.profile_banner_url = None
+
+
+class FakeTweet:
+    def __init__(self, tweet_id: str, user: FakeUser, text: str, in_reply_to: str = None, quote=None):
+        self.id = tweet_id
+        self.user = user
+        self.text = text
+        self.full_text = text
+        self.created_at = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=int(tweet_id))
+        self.media = []
+        self.in_reply_to = in_reply_to
+        self.is_quote_status = quote is not None
+        self.quote = quote
+        self.favorited = False
+        self.favorite_count = int(tweet_id) % 97
+        self.reply_count = int(tweet_id) % 13
+        self.retweet_count = int(tweet_id) % 31
+        self.quote_count = int(tweet_id) % 5
+        self.view_count = str(int(tweet_id) * 11)
+        self.replies = None
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, sender_id: str, recipient_id: str, text: str):
+        self.id = str(message_id)
+        self.time = str(1704067200000 + message_id)
+        self.text = text
+        self.sender_id = sender_id
+        self.recipient_id = recipient_id
+        self.attachment = None
+
+
+class FakeTwitter:
+    """Stand-in for twikit's Client, serving deterministic generated data.
+
+    Tweet IDs run from 1 to ``tweet_count``; the same ID always yields the same tweet, so
+    cached and fresh copies agree. ``reply_ratio`` and ``quote_ratio`` set how many tweets
+    reply to or quote an older one. ``rate_limit`` calls per method are allowed in each
+    ``rate_window`` seconds, after which calls raise TooManyRequests (0 turns limits off).
+    Every conversation starts with ``dm_count`` messages, and send_dm adds to it.
+    """
+
+    REPLY_DISTANCE = 50  # Replies point at most this many tweets back, so finding them stays cheap
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5, page_size: int = 20,
+                 reply_ratio: float = 0.3, quote_ratio: float = 0.1, rate_limit: int = 0,
+                 rate_window: float = 900, tweet_count: int = 5000, user_count: int = 200, dm_count: int = 60, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.page_size = page_size
+        self.reply_ratio = reply_ratio
+        self.quote_ratio = quote_ratio
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.tweet_count = tweet_count
+        self.user_count = user_count
+        self.dm_count = dm_count
+        self.seed = seed
+        self.conversations = {}  # other user's ID -> [FakeMessage], oldest first
+        self._random = random.Random(seed)
+        self.calls = Counter()  # method -> calls made
+        self._windows = {}  # method -> (window start, calls in window)
+
+    async def _call(self, method: str):
+        self.calls[method] += 1
+        if self.rate_limit:
+            now = time.time()
+            started, used = self._windows.get(method, (now, 0))
+            if now - started >= self.rate_window:
+                started, used = now, 0
+            if used >= self.rate_limit:
+                reset = int(started + self.rate_window)
+                raise TooManyRequests("Rate limit exceeded", headers={'x-rate-limit-reset': str(reset)})
+            self._windows[method] = (started, used + 1)
+        if self.latency:
+            spread = self.latency * self.jitter
+            await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-spread, spread)))
+
+    def _hash(self, number: int, salt: int) -> int:
+        return (number * 2654435761 + salt * 40503 + self.seed) % 2 ** 32
+
+    def parent_of(self, number: int):
+        """ID of the tweet ``number`` replies to, at most REPLY_DISTANCE tweets older, or None."""
+        value = self._hash(number, 1)
+        if number == 1 or value / 2 ** 32 >= self.reply_ratio:
+            return None
+        return number - 1 - value % min(number - 1, self.REPLY_DISTANCE)
+
+    def make_user(self, user_id) -> FakeUser:
+        return FakeUser(str(user_id))
+
+    def make_tweet(self, tweet_id, depth: int = 0) -> FakeTweet:
+        number = int(tweet_id)
+        generator = random.Random(self._hash(number, 2))
+        text = " ".join(generator.choice(WORDS) for _ in range(generator.randint(5, 30)))
+        user = self.make_user(generator.randint(1, self.user_count))
+        parent = self.parent_of(number)
+        quote = None
+        if number > 1 and depth == 0 and generator.random() < self.quote_ratio:
+            quote = self.make_tweet(generator.randint(1, number - 1), depth + 1)
+        return FakeTweet(str(number), user, text, str(parent) if parent else None, quote)
+
+    def _page(self, ids: list, cursor, fetch_page):
+        """A FakeResult of ``ids`` starting at integer offset ``cursor``, paged by page_size."""
+        offset = int(cursor or 0)
+        page_ids = ids[offset:offset + self.page_size]
+        next_cursor = str(offset + self.page_size) if offset + self.page_size < len(ids) else None
+        fetch_next = (lambda: fetch_page(next_cursor)) if next_cursor else None
+        return FakeResult([self.make_tweet(tweet_id) for tweet_id in page_ids], fetch_next, next_cursor)
+
+    # The subset of twikit's Client that TwitterClient uses
+
+    async def user_id(self):
+        return '1'
+
+    async def user(self):
+        await self._call('user')
+        return self.make_user(1)
+
+    async def get_latest_timeline(self, count: int = 20, seen_tweet_ids=None, cursor: str = None):
+        await self._call('get_latest_timeline')
+        ids = list(range(self.tweet_count, 0, -1))
+        return self._page(ids, cursor, lambda next_cursor: self.get_latest_timeline(count, cursor=next_cursor))
+
+    async def get_tweet_by_id(self, tweet_id, cursor: str = None):
+        await self._call('get_tweet_by_id')
+        tweet = self.make_tweet(tweet_id)
+        number = int(tweet_id)
+        # Replies are the later tweets that picked this one as their parent
+        last = min(self.tweet_count, number + self.REPLY_DISTANCE)
+        reply_ids = [candidate for candidate in range(number + 1, last + 1) if self.parent_of(candidate) == number]
+        tweet.replies = FakeResult([self.make_tweet(reply_id) for reply_id in reply_ids[:self.page_size]])
+        return tweet
+
+    async def get_bookmarks(self, count: int = 20, cursor: str = None):
+        await self._call('get_bookmarks')
+        ids = list(range(self.tweet_count, 0, -37))
+        return self._page(ids, cursor, lambda next_cursor: self.get_bookmarks(count, cursor=next_cursor))
+
+    async def get_user_following(self, user_id, count: int = 20, cursor: str = None):
+        await self._call('get_user_following')
+        offset = int(cursor or 0)
+        ids = list(range(2, self.user_count + 1, 3))
+        page = [self.make_user(following_id) for following_id in ids[offset:offset + count]]
+        next_cursor = str(offset + count) if offset + count < len(ids) else None
+        fetch_next = (lambda: self.get_user_following(user_id, count, next_cursor)) if next_cursor else None
+        return FakeResult(page, fetch_next, next_cursor)
+
+    async def get_user_by_screen_name(self, screen_name: str):
+        await self._call('get_user_by_screen_name')
+        return self.make_user(int(''.join(filter(str.isdigit, screen_name)) or 1))
+
+    async def get_user_by_id(self, user_id):
+        await self._call('get_user_by_id')
+        return self.make_user(user_id)
+
+    async def get_user_tweets(self, user_id, tweet_type: str = 'Tweets', count: int = 20, cursor: str = None):
+        await self._call('get_user_tweets')
+        ids = list(range(self.tweet_count - int(user_id), 0, -self.user_count))
+        return self._page(ids, cursor, lambda next_cursor: self.get_user_tweets(user_id, tweet_type, count, next_cursor))
+
+    async def search_tweet(self, query: str, product: str = 'Top', count: int = 20, cursor: str = None):
+        await self._call('search_tweet')
+        step = 3 + sum(map(ord, query)) % 17
+        ids = list(range(self.tweet_count, 0, -step))
+        return self._page(ids, cursor, lambda next_cursor: self.search_tweet(query, product, count, next_cursor))
+
+    async def search_user(self, query: str, count: int = 20, cursor: str = None):
+        await self._call('search_user')
+        first = sum(map(ord, query)) % self.user_count + 1
+        return FakeResult([self.make_user((first + offset) % self.user_count + 1) for offset in range(count)])
+
+    async def get_notifications(self, type: str = 'All', count: int = 40, cursor: str = None):
+        await self._call('get_notifications')
+        return FakeResult([])
+
+    def conversation(self, user_id) -> list:
+        user_id = str(user_id)
+        if user_id not in self.conversations:
+            generator = random.Random(self._hash(int(user_id), 3))
+            self.conversations[user_id] = [
+                FakeMessage(int(user_id) * 100000 + index, *(('1', user_id) if index % 3 else (user_id, '1')),
+                            " ".join(generator.choice(WORDS) for _ in range(generator.randint(1, 12))))
+                for index in range(1, self.dm_count + 1)
+            ]
+        return self.conversations[user_id]
+
+    async def get_dm_history(self, user_id, max_id: str = None):
+        await self._call('get_dm_history')
+        older = [message for message in reversed(self.conversation(user_id))
+                 if max_id is None or int(message.id) < int(max_id)]
+        page = older[:self.page_size]
+        next_cursor = page[-1].id if page else None
+        return FakeResult(page, lambda: self.get_dm_history(user_id, next_cursor), next_cursor)
+
+    async def send_dm(self, user_id, text: str, media_id: str = None, reply_to: str = None):
+        await self._call('send_dm')
+        messages = self.conversation(user_id)
+        message_id = int(messages[-1].id) + 1 if messages else int(user_id) * 100000 + 1
+        # Like twikit's, the returned sender and recipient are not to be trusted
+        message = FakeMessage(message_id, str(user_id), '1', text)
+        messages.append(FakeMessage(message_id, '1', str(user_id), text))
+        return message
+
+    def __getattr__(self, name):
+        # Writes (favorite_tweet, follow_user, send_dm...) only cost a round trip
+        if name not in WRITE_METHODS:
+            raise AttributeError(name)
+
+        async def write(*args, **kwargs):
+            await self._call(name)
+        return write
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def drive(call, arguments: list, concurrency: int) -> tuple:
+    """Run ``call(argument)`` for every argument, ``concurrency`` at a time; returns (latencies, errors)."""
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = Counter()
+
+    async def one(argument):
+        async with limit:
+            started = time.perf_counter()
+            try:
+                await call(argument)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(argument) for argument in arguments))
+    return sorted(latencies), errors
+
+
+def client_scenarios(fake: FakeTwitter) -> dict:
+    """Scenario name -> (function of (TwitterClient, argument), argument generator)."""
+    def tweet_ids(generator):
+        # Popular tweets come up again and again, as they do in real traffic
+        return str(int(generator.paretovariate(1.2) * 10) % fake.tweet_count + 1)
+
+    return {
+        'get_home_feed': (
+            lambda client, page: client.get_home_feed(count=fake.page_size, cursor=page),
+            lambda generator: None if generator.random() < 0.7 else str(fake.page_size * generator.randint(1, 5)),
+        ),
+        'get_tweet': (lambda client, tweet_id: client.get_tweet(tweet_id), tweet_ids),
+        'get_replies': (lambda client, tweet_id: client.get_replies(tweet_id), tweet_ids),
+        'get_user_profile': (
+            lambda client, username: client.get_user_profile(username),
+            lambda generator: f"user{generator.randint(1, 20)}",
+        ),
+        'search_twitter': (
+            lambda client, query: client.search_twitter(query),
+            lambda generator: generator.choice(WORDS),
+        ),
+    }
+
+
+def route_paths(scenario: str, argument) -> str:
+    return {
+        'get_home_feed': f"/home_feed?cursor={argument}" if argument else "/home_feed",
+        'get_tweet': f"/tweet/{argument}",
+        'get_replies': f"/tweet/{argument}/replies",
+        'get_user_profile': f"/user_profile/{argument}",
+        'search_twitter': f"/search/{argument}",
+    }[scenario]
+
+
+def load_app():
+    """Import app.py without cookies or an on-disk cache, so its clients can be swapped for fakes."""
+    os.environ["TWEETAWAY_CACHE_DIR"] = ""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "cookie.json"), "w") as file:
+            file.write("{}")
+        os.chdir(directory)
+        try:
+            import app
+        finally:
+            os.chdir(working_directory)
+    return app
+
+
+def new_client(options) -> tuple:
+    fake = FakeTwitter(
+        latency=options.latency, jitter=options.jitter, page_size=options.page_size,
+        reply_ratio=options.reply_ratio, quote_ratio=options.quote_ratio,
+        rate_limit=options.rate_limit, rate_window=options.rate_window, seed=options.seed,
+    )
+    return fake, TwitterClient("bench.json", client=fake)
+
+
+async def run_scenario(options, name: str, over_http: bool) -> dict:
+    generator = random.Random(options.seed)
+    fake, client = new_client(options)
+    call, make_argument = client_scenarios(fake)[name]
+    arguments = [make_argument(generator) for _ in range(options.requests)]
+
+    if over_http:
+        app = load_app()
+        app.accounts.clear()
+        app.accounts[client.account.name] = client
+        app.twitter_client = client
+        test_client = app.app.test_client()
+
+        async def target(argument):
+            response = await test_client.get(route_paths(name, argument))
+            if response.status_code >= 400:
+                raise RuntimeError(f"HTTP {response.status_code}")
+    else:
+        async def target(argument):
+            await call(client, argument)
+
+    latencies, errors = await drive(target, arguments, options.concurrency)
+    upstream_calls = sum(fake.calls.values())
+
+    # Allocations: replay a slice of the same requests against a fresh client with tracemalloc on
+    allocated_per_request = peak = 0
+    if options.allocation_requests:
+        fake, client = new_client(options)
+        if over_http:
+            app.accounts.clear()
+            app.accounts[client.account.name] = client
+            app.twitter_client = client
+        sample = arguments[:options.allocation_requests]
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        await drive(target, sample, options.concurrency)
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename') if stat.size_diff > 0)
+        allocated_per_request = allocated / len(sample)
+
+    return {
+        'scenario': ('http ' if over_http else '') + name,
+        'requests': len(latencies),
+        'errors': dict(errors),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        'upstream_per_request': upstream_calls / max(1, len(latencies)),
+        'retained_kib_per_request': allocated_per_request / 1024,
+        'peak_kib': peak / 1024,
+    }
+
+
+def print_report(results: list):
+    header = f"{'scenario':<26}{'reqs':>6}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'upstream/req':>14}{'KiB/req':>10}{'peak KiB':>10}  errors"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(
+            f"{result['scenario']:<26}{result['requests']:>6}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+            f"{result['max_ms']:>10.1f}{result['upstream_per_request']:>14.2f}{result['retained_kib_per_request']:>10.1f}"
+            f"{result['peak_kib']:>10.0f}  {result['errors'] or ''}"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=200, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=20, help="requests in flight at once")
+    parser.add_argument('--latency', type=float, default=0.05, help="mean upstream latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.5, help="latency spread as a fraction of the mean")
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--reply-ratio', type=float, default=0.3, help="share of tweets that are replies")
+    parser.add_argument('--quote-ratio', type=float, default=0.1, help="share of tweets that quote another")
+    parser.add_argument('--rate-limit', type=int, default=0, help="calls per method per window, 0 for no limit")
+    parser.add_argument('--rate-window', type=float, default=900, help="rate-limit window in seconds")
+    parser.add_argument('--allocation-requests', type=int, default=50, help="requests replayed under tracemalloc, 0 to skip")
+    parser.add_argument('--scenarios', default=','.join(client_scenarios(FakeTwitter()).keys()))
+    parser.add_argument('--no-http', action='store_true', help="only call TwitterClient, skip the routes")
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    options = parse_args(argv)
+    results = []
+    for name in options.scenarios.split(','):
+        results.append(await run_scenario(options, name, over_http=False))
+        if not options.no_http:
+            results.append(await run_scenario(options, name, over_http=True))
+    print_report(results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,413 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from scheduler import BACKGROUND, current_priority, priority
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteIdSet:
+    """In-memory set of IDs mirrored from a paginated Twitter endpoint, reloaded once its TTL runs out.
+
+    A reload stops after ``max_pages`` pages (None walks to the end); when that leaves pages
+    unread, a warning is logged and ``truncated`` is set until a later reload completes.
+    A failed reload is retried after ``retry_after_error`` seconds, not a whole TTL.
+    """
+
+    def __init__(self, ttl: float = 300, page_size: int = 100, max_pages: int = 10, retry_after_error: float = 30):
+        self.ttl = ttl
+        self.retry_after_error = retry_after_error
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.truncated = False  # Whether the last full reload stopped at max_pages
+        self.on_refresh = None  # Optional callback given the new IDs after each reload
+        self.on_page = None  # Optional callback given the items of every page fetched
+        self._ids = set()
+        self._loaded = False  # Whether _ids holds real data yet, fetched or seeded
+        self._refreshed_at = None
+        self._retry_at = None  # After a failed reload, when the next one may run
+        self._pending = {}  # Local changes made while a refresh is running
+        self._refreshing = False
+        self._revalidation = None
+        self._lock = asyncio.Lock()
+
+    def _backing_off(self):
+        return self._retry_at is not None and time.monotonic() < self._retry_at
+
+    def is_stale(self):
+        if self._backing_off():
+            return False
+        return self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.ttl
+
+    def contains(self, item_id) -> bool:
+        return str(item_id) in self._ids
+
+    def add(self, item_id):
+        item_id = str(item_id)
+        self._ids.add(item_id)
+        if self._refreshing:
+            self._pending[item_id] = True
+
+    def discard(self, item_id):
+        item_id = str(item_id)
+        self._ids.discard(item_id)
+        if self._refreshing:
+            self._pending[item_id] = False
+
+    def update(self, item_ids):
+        """Record IDs we already know belong to the set."""
+        for item_id in item_ids:
+            self.add(item_id)
+
+    def invalidate(self):
+        self._refreshed_at = None
+
+    def seed(self, item_ids, age: float = 0):
+        """Load IDs saved earlier, e.g. on disk, as if they had been fetched ``age`` seconds ago."""
+        self._ids = {str(item_id) for item_id in item_ids}
+        self._refreshed_at = time.monotonic() - age
+        self._loaded = True
+
+    def ids(self) -> set:
+        return set(self._ids)
+
+    async def _fetch_page(self, client, cursor: str = None):
+        """One page of the endpoint. Follow-up pages are fetched with the previous page's
+        next_cursor through ``client``, not Result.next(), so they stay scheduled."""
+        raise NotImplementedError
+
+    async def _load(self, client):
+        """Walk the endpoint page by page and return every ID it yields."""
+        ids = set()
+        pages = 0
+        truncated = False
+        page = await self._fetch_page(client)
+        while page:
+            if self.on_page is not None:
+                self.on_page(page)
+            ids.update(str(item.id) for item in page)
+            pages += 1
+            if not getattr(page, 'next_cursor', None):
+                break
+            if self.max_pages is not None and pages >= self.max_pages:
+                truncated = True
+                logger.warning("%s stopped after %d pages (%d IDs); the set is incomplete",
+                               type(self).__name__, pages, len(ids))
+                break
+            page = await self._fetch_page(client, page.next_cursor)
+        self.truncated = truncated
+        return ids
+
+    async def ensure_fresh(self, client):
+        """Make sure the set is fresh enough to answer from.
+
+        The first load is awaited. After that a stale set keeps answering while it
+        reloads in the background (stale-while-revalidate).
+        """
+        if not self.is_stale():
+            return
+        if not self._loaded:
+            await self.refresh(client)
+        elif self._revalidation is None or self._revalidation.done():
+            self._revalidation = asyncio.create_task(self._revalidate(client))
+
+    async def _revalidate(self, client):
+        with priority(BACKGROUND):
+            await self.refresh(client)
+
+    async def refresh(self, client):
+        """Reload the set from Twitter if it is still stale once we hold the lock."""
+        async with self._lock:
+            if not self.is_stale():  # Another request refreshed it while we waited
+                return
+            self._refreshing = True
+            self._pending = {}
+            try:
+                ids = await self._load(client)
+
+                # Re-apply local changes that happened during the reload
+                for item_id, present in self._pending.items():
+                    if present:
+                        ids.add(item_id)
+                    else:
+                        ids.discard(item_id)
+                self._ids = ids
+                self._loaded = True
+                self._refreshed_at = time.monotonic()
+                self._retry_at = None
+                if self.on_refresh is not None:
+                    self.on_refresh(ids)
+            except Exception as e:
+                # Keep serving the previous set rather than failing the whole page, and try again soon
+                self._retry_at = time.monotonic() + min(self.retry_after_error, self.ttl)
+                logger.warning("Error refreshing %s: %s", type(self).__name__, e)
+            finally:
+                self._refreshing = False
+                self._pending = {}
+
+
+class BookmarkIndex(RemoteIdSet):
+    """Set of bookmarked tweet IDs."""
+
+    async def _fetch_page(self, client, cursor: str = None):
+        return await client.get_bookmarks(count=self.page_size, cursor=cursor)
+
+
+class FollowingSet(RemoteIdSet):
+    """Set of user IDs the logged-in account follows.
+
+    The whole following list is walked once every ``ttl`` seconds, to the end by default.
+    In between, every ``refresh_interval`` seconds only the newest pages are fetched,
+    stopping at the first account we already know about.
+    """
+
+    def __init__(self, ttl: float = 1800, refresh_interval: float = 120, page_size: int = 100, max_pages: int = None):
+        super().__init__(ttl=ttl, page_size=page_size, max_pages=max_pages)
+        self.refresh_interval = refresh_interval
+        self._full_load_at = None
+
+    def _full_load_due(self):
+        return self._full_load_at is None or time.monotonic() - self._full_load_at > self.ttl
+
+    def is_stale(self):
+        if self._backing_off():
+            return False
+        if self._full_load_due():
+            return True
+        return self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.refresh_interval
+
+    def invalidate(self):
+        self._full_load_at = None
+
+    def seed(self, item_ids, age: float = 0):
+        super().seed(item_ids, age)
+        self._full_load_at = self._refreshed_at  # A saved set was a complete list when written
+
+    async def _fetch_page(self, client, cursor: str = None):
+        user_id = await client.user_id()
+        return await client.get_user_following(user_id, count=self.page_size, cursor=cursor)
+
+    async def _load(self, client):
+        if self._full_load_due():
+            ids = await super()._load(client)
+            self._full_load_at = time.monotonic()
+            return ids
+
+        # Incremental refresh: the following list is newest first, so stop at the first known ID
+        ids = set(self._ids)
+        pages = 0
+        page = await self._fetch_page(client)
+        while page:
+            if self.on_page is not None:
+                self.on_page(page)
+            page_ids = [str(user.id) for user in page]
+            known = any(user_id in ids for user_id in page_ids)
+            ids.update(page_ids)
+            pages += 1
+            if known or not getattr(page, 'next_cursor', None):
+                break
+            if self.max_pages is not None and pages >= self.max_pages:
+                break  # The next full reload fills in the rest
+            page = await self._fetch_page(client, page.next_cursor)
+        return ids
+
+
+class CurrentUser:
+    """The logged-in account's own twikit User, refetched in the background every ``ttl`` seconds.
+
+    Only the very first read waits for Twitter. After that a stale profile keeps being
+    served while a refresh runs (stale-while-revalidate). Our own follows and unfollows
+    adjust following_count right away, and the next read refetches in the background.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self.user = None
+        self._fetched_at = None
+        self._revalidation = None
+        self._lock = asyncio.Lock()
+
+    def is_stale(self):
+        return self._fetched_at is None or time.monotonic() - self._fetched_at > self.ttl
+
+    def invalidate(self):
+        self._fetched_at = None
+
+    def adjust_following(self, delta: int):
+        """Count a follow (+1) or unfollow (-1) we just made, until the next refetch confirms it."""
+        if self.user is not None and self.user.following_count is not None:
+            self.user.following_count = max(0, self.user.following_count + delta)
+        self.invalidate()
+
+    async def refresh(self, client):
+        async with self._lock:
+            if not self.is_stale():  # Another request refreshed it while we waited
+                return
+            self.user = await client.user()
+            self._fetched_at = time.monotonic()
+
+    async def _revalidate(self, client):
+        try:
+            with priority(BACKGROUND):
+                await self.refresh(client)
+        except Exception as e:
+            logger.warning("Error refreshing the logged-in user: %s", e)
+
+    async def get(self, client):
+        if self.user is None:
+            await self.refresh(client)
+        elif self.is_stale() and (self._revalidation is None or self._revalidation.done()):
+            self._revalidation = asyncio.create_task(self._revalidate(client))
+        return self.user
+
+
+class LRUCache:
+    """Bounded LRU cache with a per-entry TTL and hit/miss/eviction counters."""
+
+    def __init__(self, max_size: int = 1000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (stored_at, value), oldest first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and time.monotonic() - entry[0] <= self.ttl
+
+    def get(self, key):
+        """Return the cached value, or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key):
+        """Like get(), but without touching the counters or the LRU order."""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class TweetCache(LRUCache):
+    """LRU cache of twikit Tweet objects keyed by tweet ID."""
+
+    def get(self, tweet_id):
+        return super().get(str(tweet_id))
+
+    def put(self, tweet):
+        self.set(str(tweet.id), tweet)
+
+    def invalidate(self, tweet_id):
+        super().invalidate(str(tweet_id))
+
+
+class UserDirectory:
+    """Two-way screen name <-> user ID map, filled from every twikit User we come across.
+
+    Screen names are matched case-insensitively. When a user turns up under a new screen
+    name, the old name stops resolving to them.
+    """
+
+    def __init__(self, max_size: int = 50000, ttl: float = 7 * 24 * 60 * 60):
+        self._ids = LRUCache(max_size, ttl)  # lowercased screen name -> user ID
+        self._names = LRUCache(max_size, ttl)  # user ID -> screen name as Twitter spells it
+
+    def __len__(self):
+        return len(self._names)
+
+    def remember(self, user):
+        if user is None or not getattr(user, 'id', None) or not getattr(user, 'screen_name', None):
+            return
+        user_id = str(user.id)
+        old_name = self._names.peek(user_id)
+        if old_name is not None and old_name.lower() != user.screen_name.lower():
+            self._ids.invalidate(old_name.lower())
+        self._ids.set(user.screen_name.lower(), user_id)
+        self._names.set(user_id, user.screen_name)
+
+    def remember_many(self, users):
+        for user in users:
+            self.remember(user)
+
+    def id_for(self, screen_name: str):
+        return self._ids.get(screen_name.lstrip('@').lower())
+
+    def name_for(self, user_id):
+        return self._names.get(str(user_id))
+
+    def stats(self) -> dict:
+        return {'names': self._ids.stats(), 'ids': self._names.stats()}
+
+
+def _freeze(value):
+    """Turn call arguments into something hashable so they can key a SingleFlight call."""
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+class SingleFlight:
+    """Collapses identical concurrent calls into one: later callers await the first caller's result.
+
+    Calls only share when they run at the same priority, so a page load never inherits a
+    background call's wait for a rate-limit window, or its RateLimited.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> in-flight asyncio.Task
+        self.shared = 0  # Calls answered by someone else's request
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, name: str, func, *args, **kwargs):
+        key = (name, current_priority(name), _freeze(args), _freeze(kwargs))
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.shared += 1
+        # Shield the shared task so one caller disconnecting doesn't cancel it for the others
+        return await asyncio.shield(task)
@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+
+def serialize_message(message, sender_id: str = None, recipient_id: str = None) -> dict:
+    return {
+        'id': str(message.id),
+        'sender': str(sender_id or message.sender_id),
+        'recipient': str(recipient_id or message.recipient_id),
+        'text': message.text,
+        'time': message.time,
+    }
+
+
+def _newer(message_id, than_id) -> bool:
+    return than_id is None or int(message_id) > int(than_id)
+
+
+class Conversation:
+    """The messages we hold for one DM conversation, newest first, with what's known about its ends."""
+
+    def __init__(self, messages: list = None, reached_start: bool = False, synced_at: float = None,
+                 synced_id: str = None):
+        self.messages = messages or []
+        self.reached_start = reached_start  # Whether messages goes back to the first message ever sent
+        self.synced_at = synced_at  # time.time() of the last check for newer messages
+        # Newest message a sync has seen; ones we sent since don't count, others may have arrived before them
+        self.synced_id = synced_id
+        self.lock = asyncio.Lock()
+
+    @property
+    def newest_id(self):
+        return self.messages[0]['id'] if self.messages else None
+
+    @property
+    def oldest_id(self):
+        return self.messages[-1]['id'] if self.messages else None
+
+    def to_dict(self) -> dict:
+        return {'messages': self.messages, 'reached_start': self.reached_start,
+                'synced_at': self.synced_at, 'synced_id': self.synced_id}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data.get('messages'), data.get('reached_start', False), data.get('synced_at'), data.get('synced_id'))
+
+
+class DirectMessages:
+    """Local copy of DM conversations, kept in sync incrementally.
+
+    Opening a conversation only asks Twitter for messages newer than the newest one we
+    hold, and skips even that if it was checked in the last ``fresh_for`` seconds. Older
+    history is fetched a page at a time as the user scrolls back. Messages we send are
+    added straight away. With a Store, conversations survive restarts. At most
+    ``max_messages`` are kept per conversation; anything older is paged in again on demand.
+    """
+
+    def __init__(self, store=None, spawn=None, fresh_for: float = 10, max_pages: int = 5, max_messages: int = 1000):
+        self.store = store
+        self.spawn = spawn or asyncio.ensure_future  # Runs store writes in the background
+        self.fresh_for = fresh_for
+        self.max_pages = max_pages
+        self.max_messages = max_messages
+        self._conversations = {}  # other user's ID -> Conversation
+
+    async def conversation(self, user_id: str) -> Conversation:
+        user_id = str(user_id)
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            entry = await self.store.get('dm', user_id, max_age=float('inf')) if self.store is not None else None
+            conversation = Conversation.from_dict(entry[0]) if entry is not None else Conversation()
+            conversation = self._conversations.setdefault(user_id, conversation)
+        return conversation
+
+    def _save(self, user_id: str, conversation: Conversation):
+        if len(conversation.messages) > self.max_messages:
+            del conversation.messages[self.max_messages:]
+            conversation.reached_start = False
+        if self.store is not None:
+            self.spawn(self.store.put('dm', str(user_id), conversation.to_dict()))
+
+    async def _fetch_newer(self, client, user_id: str, conversation: Conversation) -> list:
+        """Add the messages newer than the last sync to ``conversation`` and return them, newest first."""
+        newest_id = conversation.synced_id or conversation.newest_id
+        known = {message['id'] for message in conversation.messages}
+        new_messages = []
+        page = await client.get_dm_history(user_id)
+        latest_id = str(page[0].id) if page else None
+        pages = 1
+        while True:
+            if not page:
+                if newest_id is None:
+                    conversation.reached_start = True
+                break
+            fresh = [message for message in page if _newer(message.id, newest_id)]
+            new_messages += [serialize_message(message) for message in fresh if str(message.id) not in known]
+            if len(fresh) < len(page) or newest_id is None:
+                break  # Caught up with what we had, or this is a first sync: older pages can wait
+            if pages >= self.max_pages:
+                # More new messages than we were willing to page through: keep just those, not a gap
+                conversation.messages = []
+                conversation.reached_start = False
+                break
+            page = await client.get_dm_history(user_id, max_id=page.next_cursor)  # Not page.next(): stay scheduled
+            pages += 1
+
+        if latest_id is not None:
+            conversation.synced_id = latest_id
+        if new_messages:
+            conversation.messages = sorted(new_messages + conversation.messages,
+                                           key=lambda message: int(message['id']), reverse=True)
+        conversation.synced_at = time.time()
+        self._save(user_id, conversation)
+        return new_messages
+
+    async def sync(self, client, user_id: str, force: bool = False) -> Conversation:
+        """Fetch the messages newer than the newest we hold."""
+        conversation = await self.conversation(user_id)
+        async with conversation.lock:
+            if force or not conversation.synced_at or time.time() - conversation.synced_at >= self.fresh_for:
+                await self._fetch_newer(client, user_id, conversation)
+            return conversation
+
+    async def poll(self, client, user_id: str) -> list:
+        """The messages that arrived since the last sync, newest first.
+
+        A conversation that was never synced returns nothing: the chat view loads it itself.
+        """
+        conversation = await self.conversation(user_id)
+        async with conversation.lock:
+            first_sync = conversation.synced_id is None and not conversation.messages
+            new_messages = await self._fetch_newer(client, user_id, conversation)
+            return [] if first_sync else new_messages
+
+    async def older(self, client, user_id: str, before: str, count: int) -> list:
+        """Up to ``count`` messages older than ``before``, newest first, fetching more history if needed."""
+        conversation = await self.conversation(user_id)
+        async with conversation.lock:
+            older = [message for message in conversation.messages if int(message['id']) < int(before)]
+            if len(older) < count and not conversation.reached_start and conversation.oldest_id is not None:
+                page = await client.get_dm_history(user_id, max_id=conversation.oldest_id)
+                known = {message['id'] for message in conversation.messages}
+                fetched = [serialize_message(message) for message in page if str(message.id) not in known]
+                if not fetched:
+                    conversation.reached_start = True
+                conversation.messages += fetched
+                older += [message for message in fetched if int(message['id']) < int(before)]
+                self._save(user_id, conversation)
+            return older[:count]
+
+    async def append(self, user_id: str, message: dict):
+        """Add a message we just sent, so the conversation doesn't need to be refetched to show it."""
+        conversation = await self.conversation(user_id)
+        async with conversation.lock:
+            if not any(existing['id'] == message['id'] for existing in conversation.messages[:20]):
+                conversation.messages.insert(0, message)
+                self._save(user_id, conversation)
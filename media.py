@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_BYTES = 5 * 1024 * 1024  # Twitter's limit for still images
+MAX_IMAGE_SIDE = 4096  # Longest side we upload; bigger images are downscaled
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class MediaUploadError(RuntimeError):
+    """Raised when some images in a batch failed to upload.
+
+    ``media_ids`` keeps the slot order of the request, with None for each empty slot and
+    each image that failed, so successful uploads can be reused instead of sent again.
+    ``failures`` maps each failed slot index to the error it raised.
+    """
+
+    def __init__(self, media_ids: list, failures: dict):
+        self.media_ids = media_ids
+        self.failures = failures
+        details = ", ".join(f"image {index + 1}: {error}" for index, error in sorted(failures.items()))
+        attempted = len(failures) + sum(media_id is not None for media_id in media_ids)
+        super().__init__(f"{len(failures)} of {attempted} images failed to upload ({details})")
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents, read in chunks so large images never sit in memory whole."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prepare_image(path: str):
+    """Fit an image within Twitter's upload limits.
+
+    Returns the path untouched when the image is already small enough (and for animated
+    GIFs, which would lose their frames), otherwise the re-encoded image as bytes.
+    """
+    file_size = os.path.getsize(path)
+    with Image.open(path) as image:
+        if getattr(image, "is_animated", False):
+            return path
+        if file_size <= MAX_IMAGE_BYTES and max(image.size) <= MAX_IMAGE_SIDE:
+            return path
+        source_format = image.format
+
+        # For JPEGs this makes the decoder scale down while reading, instead of after
+        image.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+
+        buffer = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "P") and source_format == "PNG":
+            image.save(buffer, "PNG", optimize=True)
+            if buffer.tell() <= MAX_IMAGE_BYTES:
+                return buffer.getvalue()
+
+        # Fall back to JPEG, stepping the quality down until it fits
+        image = image.convert("RGB")
+        for quality in (90, 80, 70, 60, 50):
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality, optimize=True)
+            if buffer.tell() <= MAX_IMAGE_BYTES:
+                break
+        return buffer.getvalue()
+
+
+class MediaCache:
+    """Content hash -> media ID map, kept in a JSON file so repeat attachments skip the upload.
+
+    Twitter only honours a media ID for a limited time, and only for the account that
+    uploaded it, so entries expire after ``ttl`` seconds and each account needs its own file.
+    """
+
+    def __init__(self, path: str = "media_cache.json", ttl: float = 12 * 60 * 60):
+        self.path = path
+        self.ttl = ttl
+        self._entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.warning("Ignoring unreadable media cache %s: %s", path, e)
+        self._drop_expired()
+
+    def _drop_expired(self):
+        now = time.time()
+        self._entries = {
+            digest: entry for digest, entry in self._entries.items()
+            if now - entry["uploaded_at"] <= self.ttl
+        }
+
+    def get(self, digest: str):
+        entry = self._entries.get(digest)
+        if entry is None or time.time() - entry["uploaded_at"] > self.ttl:
+            return None
+        return entry["media_id"]
+
+    def put(self, digest: str, media_id: str):
+        self._entries[digest] = {"media_id": media_id, "uploaded_at": time.time()}
+        self._drop_expired()
+        self.save()
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self._entries, file)
+        os.replace(temp_path, self.path)  # Atomic, so a crash never leaves half a file
+
+
+class MediaUploader:
+    """Uploads a tweet's images concurrently and attaches alt text as each upload finishes.
+
+    Images are downscaled to Twitter's limits before upload, and an image whose content
+    was uploaded recently reuses the earlier media ID instead of being sent again.
+    """
+
+    def __init__(self, client, max_concurrent: int = 4, cache: MediaCache = None):
+        self.client = client
+        self.limit = asyncio.Semaphore(max_concurrent)
+        self.cache = cache if cache is not None else MediaCache()
+
+    async def _upload_one(self, image_path: str, alt_text: str = None):
+        digest = await asyncio.to_thread(file_digest, image_path)
+        media_id = self.cache.get(digest)
+        async with self.limit:
+            if media_id is None:
+                source = await asyncio.to_thread(prepare_image, image_path)
+                media_id = await self.client.upload_media(source)
+                self.cache.put(digest, media_id)
+            if alt_text:
+                await self.client.create_media_metadata(media_id=media_id, alt_text=alt_text)
+        return media_id
+
+    async def _upload_slot(self, image_path: str, alt_text: str = None):
+        if not image_path:
+            return None  # Empty slot in the form: keep its place so indexes match the request
+        return await self._upload_one(image_path, alt_text)
+
+    async def upload(self, image_paths: list, alt_texts: list = None) -> list:
+        """Upload every image and return the media IDs in the same order as ``image_paths``.
+
+        Empty slots in ``image_paths`` get None, so IDs and failures are indexed like the request.
+        """
+        alt_texts = alt_texts or []
+        results = await asyncio.gather(
+            *(
+                self._upload_slot(image_path, alt_texts[index] if index < len(alt_texts) else None)
+                for index, image_path in enumerate(image_paths)
+            ),
+            return_exceptions=True,
+        )
+
+        failures = {index: result for index, result in enumerate(results) if isinstance(result, Exception)}
+        if failures:
+            media_ids = [None if index in failures else result for index, result in enumerate(results)]
+            raise MediaUploadError(media_ids, failures)
+        return results
@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import time
+
+# Upper bounds in seconds, from a cache hit to a slow, rate-limited upstream call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Prometheus-style latency histogram, one series per combination of label values."""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-2] + [series[-1]]):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {count}")
+            labels = _labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time; the callback returns {label values tuple: value}."""
+
+    def __init__(self, name: str, help: str, labels: tuple, collect):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.collect = collect
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for label_values, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """The whole registry in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CLIENT_SECONDS = REGISTRY.register(Histogram(
+    'tweetaway_client_call_seconds', 'Time spent in TwitterClient methods.', ('method', 'outcome'),
+))
+UPSTREAM_SECONDS = REGISTRY.register(Histogram(
+    'tweetaway_upstream_call_seconds', 'Time spent in twikit calls, excluding time queued in the scheduler.',
+    ('method', 'outcome'),
+))
+UPSTREAM_QUEUED_SECONDS = REGISTRY.register(Histogram(
+    'tweetaway_upstream_queued_seconds', 'Time twikit calls waited for a scheduler slot or rate-limit window.',
+    ('priority',),
+))
+
+
+def timed(histogram: Histogram, name: str):
+    """Decorate a coroutine function so every call is observed in ``histogram`` under ``name``."""
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = await func(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                histogram.observe(time.perf_counter() - started, name, outcome)
+        return wrapper
+    return decorate
+
+
+def instrument(cls):
+    """Class decorator: time every public coroutine method in CLIENT_SECONDS."""
+    for name, attribute in list(vars(cls).items()):
+        if not name.startswith('_') and asyncio.iscoroutinefunction(attribute):
+            setattr(cls, name, timed(CLIENT_SECONDS, name)(attribute))
+    return cls
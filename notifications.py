@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_notification(notification) -> dict:
+    notification_data = {
+        'id': notification.id,
+        'message': notification.message,
+    }
+    if notification.from_user:
+        notification_data['from_user'] = notification.from_user.name
+    if notification.tweet is not None:
+        notification_data['context_text'] = notification.tweet.text
+        notification_data['context_id'] = str(notification.tweet.id)
+    return notification_data
+
+
+class NotificationFeed:
+    """Ring buffer of the most recent notifications, topped up with only what's new.
+
+    twikit's notifications Result has no top cursor, so each refresh reads the newest page
+    and skips the IDs already in the buffer. If the whole page is new, older pages follow
+    until one overlaps the buffer, at most ``max_pages`` of them. New items add to the
+    unread count. When a refresh fails, the buffer keeps being served.
+    """
+
+    def __init__(self, max_items: int = 200, refresh_interval: float = 30, page_size: int = 40, max_pages: int = 5):
+        self.refresh_interval = refresh_interval
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._items = deque(maxlen=max_items)  # Serialized notifications, newest first
+        self._ids = set()
+        self._refreshed_at = None
+        self._lock = asyncio.Lock()
+        self.unread = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def is_stale(self):
+        return self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.refresh_interval
+
+    def _push(self, notification_data: dict):
+        if len(self._items) == self._items.maxlen:
+            self._ids.discard(self._items.pop()['id'])
+        self._items.appendleft(notification_data)
+        self._ids.add(notification_data['id'])
+
+    async def _fetch_new(self, client) -> list:
+        """Notifications not in the buffer yet, newest first."""
+        new_items = []
+        result = await client.get_notifications('All', count=self.page_size)
+        pages = 1
+        while True:
+            fresh = [notification for notification in result if notification.id not in self._ids]
+            new_items += fresh
+            if not self._ids or len(fresh) < len(result) or not result.next_cursor:
+                return new_items  # First load, or caught up with the buffer
+            if pages >= self.max_pages:
+                break  # Only fetch a page this loop will still read
+            result = await client.get_notifications('All', count=self.page_size, cursor=result.next_cursor)
+            pages += 1
+        logger.warning("More than %d pages of new notifications; older ones were skipped", self.max_pages)
+        return new_items
+
+    async def refresh(self, client) -> int:
+        """Fetch notifications newer than the buffer holds; returns how many were new."""
+        async with self._lock:
+            if not self.is_stale():  # Another request refreshed it while we waited
+                return 0
+            try:
+                new_items = await self._fetch_new(client)
+            except Exception as e:
+                if not self._items:
+                    raise
+                # Keep serving the buffer rather than failing the whole page
+                logger.warning("Error refreshing notifications: %s", e)
+                return 0
+
+            for notification in reversed(new_items):  # Oldest first, so the newest ends up in front
+                self._push(serialize_notification(notification))
+
+            if self._refreshed_at is not None:
+                self.unread += len(new_items)
+            self._refreshed_at = time.monotonic()
+            return len(new_items)
+
+    async def ensure_fresh(self, client):
+        if self.is_stale():
+            await self.refresh(client)
+
+    def latest(self, count: int = 20) -> list:
+        return list(self._items)[:count]
+
+    def mark_read(self):
+        self.unread = 0
@@ -0,0 +1,224 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+
+from twikit.errors import TooManyRequests
+
+from metrics import UPSTREAM_QUEUED_SECONDS, UPSTREAM_SECONDS
+
+# Lower runs first
+WRITE = 0  # User-facing actions: posting, DMs, likes, follows...
+READ = 1  # User-facing page loads
+INLINE = 2  # Secondary work a page is waiting on: reply-parent hydration, deeper thread levels
+BACKGROUND = 3  # Prefetching, polling, stale-while-revalidate refreshes
+
+PRIORITY_NAMES = {WRITE: 'write', READ: 'read', INLINE: 'inline', BACKGROUND: 'background'}
+
+WRITE_METHODS = {
+    'create_tweet', 'send_dm', 'upload_media', 'create_media_metadata',
+    'favorite_tweet', 'unfavorite_tweet', 'retweet', 'delete_retweet',
+    'bookmark_tweet', 'delete_bookmark', 'follow_user', 'unfollow_user',
+    'block_user', 'unblock_user',
+}
+
+# twikit method -> the Twitter endpoint whose rate-limit window it spends
+ENDPOINTS = {
+    'get_latest_timeline': 'HomeLatestTimeline',
+    'get_tweet_by_id': 'TweetDetail',
+    '_get_more_replies': 'TweetDetail',
+    'get_bookmarks': 'Bookmarks',
+    'get_user_by_screen_name': 'UserByScreenName',
+    'get_user_by_id': 'UserByRestId',
+    'get_user_tweets': 'UserTweets',
+    'get_user_following': 'Following',
+    'search_tweet': 'SearchTimeline',
+    'search_user': 'SearchTimeline',
+    'get_notifications': 'all',
+    'create_tweet': 'CreateTweet',
+    'send_dm': 'new2',
+}
+
+logger = logging.getLogger(__name__)
+
+_priority = contextvars.ContextVar('twitter_request_priority', default=None)
+
+
+def current_priority(method: str = None) -> int:
+    """The level calls made here run at: the enclosing priority() block, else WRITE or READ by method."""
+    level = _priority.get()
+    if level is None:
+        level = WRITE if method in WRITE_METHODS else READ
+    return level
+
+
+@contextmanager
+def priority(level: int):
+    """Run the twikit calls made inside this block (and tasks started from it) at ``level``."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RateLimited(RuntimeError):
+    """A call would have to wait for its rate-limit window to reset, longer than it is allowed to."""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+        super().__init__(f"Rate limited on {endpoint}, retry in {int(retry_after) + 1}s")
+
+
+class RateLimitScheduler:
+    """Priority queue in front of one account's twikit calls.
+
+    At most ``max_concurrent`` calls run at once, and when a slot frees up the waiting
+    call with the best priority gets it. Rate-limit windows are read from every response's
+    x-rate-limit-* headers. INLINE and BACKGROUND work is held back once an endpoint is down
+    to its last ``background_reserve`` share of requests, so there is budget left for the
+    user: BACKGROUND calls sleep until the window resets, INLINE calls raise RateLimited
+    straight away since a page is waiting on them. User-facing calls wait out an exhausted
+    window only if it resets within ``max_wait`` seconds, otherwise they raise RateLimited
+    rather than hanging.
+    """
+
+    def __init__(self, max_concurrent: int = 6, background_reserve: float = 0.2, max_wait: float = 10):
+        self.max_concurrent = max_concurrent
+        self.background_reserve = background_reserve
+        self.max_wait = max_wait
+        self.windows = {}  # endpoint -> (limit, remaining, reset_at)
+        self._running = 0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self.completed = {level: 0 for level in PRIORITY_NAMES}
+        self.wait_seconds = {level: 0.0 for level in PRIORITY_NAMES}
+        self.max_wait_seconds = {level: 0.0 for level in PRIORITY_NAMES}
+
+    def record(self, endpoint: str, limit: int, remaining: int, reset_at: float):
+        self.windows[endpoint] = (limit, remaining, reset_at)
+
+    async def on_response(self, response):
+        """httpx response hook: remember the rate-limit window the response reports."""
+        headers = response.headers
+        if 'x-rate-limit-remaining' not in headers:
+            return
+        endpoint = response.url.path.rstrip('/').rsplit('/', 1)[-1].removesuffix('.json')
+        try:
+            self.record(
+                endpoint,
+                int(headers.get('x-rate-limit-limit', 0)),
+                int(headers['x-rate-limit-remaining']),
+                float(headers.get('x-rate-limit-reset', 0)),
+            )
+        except ValueError:
+            pass
+
+    def _delay(self, endpoint: str, level: int) -> float:
+        """Seconds to hold a call back before its endpoint's window allows it."""
+        window = self.windows.get(endpoint)
+        if window is None:
+            return 0
+        limit, remaining, reset_at = window
+        wait = reset_at - time.time()
+        if wait <= 0:
+            return 0
+        reserve = int(limit * self.background_reserve) if level >= INLINE else 0
+        return wait if remaining <= reserve else 0
+
+    async def _acquire(self, level: int):
+        if self._running < self.max_concurrent and not self._waiters:
+            self._running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._seq), future))
+        try:
+            await future  # The slot is handed over by _release, so _running already counts us
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # We were given a slot just as we were cancelled
+            raise
+
+    def _release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._running -= 1
+
+    async def run(self, method: str, func, *args, **kwargs):
+        level = current_priority(method)
+        endpoint = ENDPOINTS.get(method, method)
+
+        queued_at = time.monotonic()
+        delay = self._delay(endpoint, level)
+        if delay > 0:
+            if level == INLINE or (level != BACKGROUND and delay > self.max_wait):
+                raise RateLimited(endpoint, delay)
+            await asyncio.sleep(delay)
+        await self._acquire(level)
+        waited = time.monotonic() - queued_at
+        self.completed[level] += 1
+        self.wait_seconds[level] += waited
+        self.max_wait_seconds[level] = max(self.max_wait_seconds[level], waited)
+        UPSTREAM_QUEUED_SECONDS.observe(waited, PRIORITY_NAMES[level])
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = await func(*args, **kwargs)
+            outcome = 'ok'
+            return result
+        except TooManyRequests as e:
+            outcome = 'rate_limited'
+            reset_at = getattr(e, 'rate_limit_reset', None) or time.time() + 15 * 60
+            limit = self.windows.get(endpoint, (0, 0, 0))[0]
+            self.record(endpoint, limit, 0, reset_at)
+            logger.info("Rate limited on %s until %s", endpoint, reset_at)
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, method, outcome)
+            self._release()
+
+    def stats(self) -> dict:
+        now = time.time()
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for level, _, future in self._waiters:
+            if not future.done():
+                queued[PRIORITY_NAMES[level]] += 1
+        return {
+            'running': self._running,
+            'queued': queued,
+            'completed': {PRIORITY_NAMES[level]: count for level, count in self.completed.items()},
+            'wait_seconds_total': {PRIORITY_NAMES[level]: total for level, total in self.wait_seconds.items()},
+            'wait_seconds_max': {PRIORITY_NAMES[level]: worst for level, worst in self.max_wait_seconds.items()},
+            'windows': {
+                endpoint: {'limit': limit, 'remaining': remaining, 'resets_in': max(0, reset_at - now)}
+                for endpoint, (limit, remaining, reset_at) in self.windows.items()
+            },
+        }
+
+
+class ScheduledClient:
+    """Drop-in stand-in for a twikit Client that sends every async call through a RateLimitScheduler."""
+
+    def __init__(self, client, scheduler: RateLimitScheduler):
+        self._client = client
+        self.scheduler = scheduler
+        http = getattr(client, 'http', None)
+        if http is not None:
+            http.event_hooks['response'].append(scheduler.on_response)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        async def scheduled(*args, **kwargs):
+            return await self.scheduler.run(name, attribute, *args, **kwargs)
+
+        return scheduled
@@ -0,0 +1,106 @@
+import math
+import re
+from collections import OrderedDict
+
+TOKEN_RE = re.compile(r"[#@]?\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list:
+    """Lowercased words, keeping the leading # or @ of hashtags and mentions."""
+    return [token.lower() for token in TOKEN_RE.findall(text or "")]
+
+
+class SearchIndex:
+    """In-memory inverted index over serialized tweets, ranked with BM25.
+
+    Every tweet the client serializes is added, so feeds, bookmarks, profiles and searches
+    the user has already seen can be searched again without an upstream call. The index
+    holds at most ``max_documents`` tweets and forgets the least recently added first.
+    """
+
+    def __init__(self, max_documents: int = 20000, k1: float = 1.2, b: float = 0.75):
+        self.max_documents = max_documents
+        self.k1 = k1
+        self.b = b
+        self._documents = OrderedDict()  # tweet_id -> serialized tweet, oldest first
+        self._lengths = {}  # tweet_id -> number of tokens
+        self._terms = {}  # tweet_id -> distinct tokens, so removal only touches its own postings
+        self._postings = {}  # token -> {tweet_id: term frequency}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, tweet_id):
+        return str(tweet_id) in self._documents
+
+    def _remove(self, tweet_id: str):
+        self._documents.pop(tweet_id)
+        self._total_length -= self._lengths.pop(tweet_id)
+        for token in self._terms.pop(tweet_id):
+            postings = self._postings[token]
+            del postings[tweet_id]
+            if not postings:
+                del self._postings[token]
+
+    def add(self, tweet_data: dict):
+        tweet_id = str(tweet_data['id'])
+        if tweet_id in self._documents:
+            # Already indexed: the text can't change, so only refresh the stored copy
+            self._documents[tweet_id] = tweet_data
+            self._documents.move_to_end(tweet_id)
+            return
+
+        tokens = tokenize(tweet_data.get('text'))
+        tokens += tokenize(tweet_data.get('author'))
+        tokens.append('@' + (tweet_data.get('username') or '').lower())
+        frequencies = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for token, frequency in frequencies.items():
+            self._postings.setdefault(token, {})[tweet_id] = frequency
+
+        self._documents[tweet_id] = tweet_data
+        self._lengths[tweet_id] = len(tokens)
+        self._terms[tweet_id] = tuple(frequencies)
+        self._total_length += len(tokens)
+        while len(self._documents) > self.max_documents:
+            self._remove(next(iter(self._documents)))
+
+    def get(self, tweet_id):
+        return self._documents.get(str(tweet_id))
+
+    def update(self, tweet_id, **fields):
+        """Change non-indexed fields of a stored tweet, e.g. is_liked; does nothing if it isn't indexed."""
+        tweet_id = str(tweet_id)
+        if tweet_id in self._documents:
+            # A new dict, since the old one may be part of a response already handed out
+            self._documents[tweet_id] = dict(self._documents[tweet_id], **fields)
+
+    def add_many(self, tweets: list):
+        for tweet_data in tweets:
+            self.add(tweet_data)
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """Return up to ``limit`` indexed tweets matching ``query``, best match first."""
+        terms = set(tokenize(query))
+        if not terms or not self._documents:
+            return []
+        # A bare word also matches its hashtag and mention forms
+        terms |= {prefix + term for term in list(terms) if term[0] not in '#@' for prefix in '#@'}
+
+        document_count = len(self._documents)
+        average_length = self._total_length / document_count or 1
+        scores = {}
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for tweet_id, frequency in postings.items():
+                length_norm = 1 - self.b + self.b * self._lengths[tweet_id] / average_length
+                score = idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                scores[tweet_id] = scores.get(tweet_id, 0) + score
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return [self._documents[tweet_id] for tweet_id in ranked]
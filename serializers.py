@@ -0,0 +1,144 @@
+import json
+from dataclasses import dataclass
+
+try:
+    import orjson  # Much faster than the stdlib encoder; pinned in requirements.txt, json is only a fallback
+except ImportError:
+    orjson = None
+
+
+@dataclass(frozen=True, slots=True)
+class Profile:
+    """Which fields a serialized tweet carries, and how nested tweets are rendered."""
+    name: str
+    fields: tuple
+    full_text: bool = False
+    nested: 'Profile' = None  # Profile used for the quoted tweet and the tweet replied to
+
+
+COUNT_FIELDS = ('reply_count', 'view_count', 'quote_count', 'retweet_count', 'likes_count')
+BASE_FIELDS = ('id', 'text', 'author', 'username', 'created_at', 'media_urls')
+STATE_FIELDS = ('is_quote', 'in_reply_to', 'is_liked', 'is_bookmarked')
+
+EMBED = Profile('embed', BASE_FIELDS, full_text=True)
+EMBED_DETAIL = Profile('embed_detail', BASE_FIELDS + COUNT_FIELDS, full_text=True)
+FEED = Profile('feed', BASE_FIELDS + STATE_FIELDS, nested=EMBED)
+DETAIL = Profile('detail', BASE_FIELDS + STATE_FIELDS + COUNT_FIELDS, full_text=True, nested=EMBED_DETAIL)
+REPLY = Profile('reply', BASE_FIELDS + STATE_FIELDS + COUNT_FIELDS)
+
+
+def timestamp(value) -> str:
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def media_urls(tweet) -> list:
+    media = getattr(tweet, 'media', None)
+    if not media:
+        return []
+    return [item['media_url_https'] for item in media if 'media_url_https' in item]
+
+
+# How each optional field is read off a twikit Tweet; only the fields in the profile are touched
+_GETTERS = {
+    'media_urls': media_urls,
+    'is_quote': lambda tweet: tweet.is_quote_status,
+    'in_reply_to': lambda tweet: tweet.in_reply_to,
+    'is_liked': lambda tweet: tweet.favorited,
+    'reply_count': lambda tweet: tweet.reply_count,
+    'view_count': lambda tweet: tweet.view_count,
+    'quote_count': lambda tweet: tweet.quote_count,
+    'retweet_count': lambda tweet: tweet.retweet_count,
+    'likes_count': lambda tweet: tweet.favorite_count,
+}
+
+
+@dataclass(slots=True)
+class TweetView:
+    """Flat, JSON-ready view of a twikit Tweet."""
+    id: str
+    text: str
+    author: str
+    username: str
+    created_at: str
+    media_urls: list = None
+    is_quote: bool = None
+    in_reply_to: str = None
+    is_liked: bool = None
+    is_bookmarked: bool = None
+    reply_count: int = None
+    view_count: int = None
+    quote_count: int = None
+    retweet_count: int = None
+    likes_count: int = None
+    quoted_tweet: 'TweetView' = None
+    reply_to: 'TweetView' = None
+    quoted_tweet_error: str = None
+    reply_to_error: str = None
+
+    @classmethod
+    def from_tweet(cls, tweet, profile: Profile, bookmarks=None, parents=None):
+        """Build a view holding only the fields ``profile`` asks for.
+
+        ``bookmarks`` is anything with a ``contains(tweet_id)`` method, and ``parents`` maps
+        ``in_reply_to`` IDs to the parent Tweet (or the exception raised fetching it).
+        """
+        view = cls(
+            id=tweet.id,
+            text=tweet.full_text if profile.full_text else tweet.text,
+            author=tweet.user.name,
+            username=tweet.user.screen_name,
+            created_at=timestamp(tweet.created_at),
+        )
+        for name in profile.fields:
+            getter = _GETTERS.get(name)
+            if getter is not None:
+                setattr(view, name, getter(tweet))
+        if 'is_bookmarked' in profile.fields:
+            view.is_bookmarked = bookmarks.contains(tweet.id) if bookmarks is not None else False
+
+        if profile.nested is None:
+            return view
+
+        # Handle quotes
+        if tweet.is_quote_status and tweet.quote is not None:
+            try:
+                view.quoted_tweet = cls.from_tweet(tweet.quote, profile.nested)
+            except Exception as e:
+                view.quoted_tweet_error = f"Error fetching quoted tweet: {e}"
+
+        # Handle replies
+        if tweet.in_reply_to and parents is not None and tweet.in_reply_to in parents:
+            parent = parents[tweet.in_reply_to]
+            if isinstance(parent, Exception):
+                view.reply_to_error = f"Error fetching reply tweet: {parent}"
+            else:
+                view.reply_to = cls.from_tweet(parent, profile.nested)
+        return view
+
+    def to_dict(self, profile: Profile) -> dict:
+        data = {name: getattr(self, name) for name in profile.fields}
+        if profile.nested is not None:
+            # Keep these keys present even when empty, the frontend checks them directly
+            data['quoted_tweet'] = self.quoted_tweet.to_dict(profile.nested) if self.quoted_tweet else None
+            data['reply_to'] = self.reply_to.to_dict(profile.nested) if self.reply_to else None
+            if self.quoted_tweet_error:
+                data['quoted_tweet_error'] = self.quoted_tweet_error
+            if self.reply_to_error:
+                data['reply_to_error'] = self.reply_to_error
+        return data
+
+
+def serialize_tweet(tweet, profile: Profile = FEED, bookmarks=None, parents=None) -> dict:
+    """Convert a twikit Tweet into a JSON-compatible dict using the given field profile."""
+    return TweetView.from_tweet(tweet, profile, bookmarks=bookmarks, parents=parents).to_dict(profile)
+
+
+def serialize_tweets(tweets, profile: Profile = FEED, bookmarks=None, parents=None) -> list:
+    return [serialize_tweet(tweet, profile, bookmarks=bookmarks, parents=parents) for tweet in tweets]
+
+
+def dumps(obj) -> str:
+    """Encode a response body as compact JSON, using orjson when it is available."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=str)
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serializers
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+)
+"""
+
+
+class Store:
+    """Persistent JSON key/value cache in SQLite, so a restart doesn't start cold.
+
+    Entries are grouped by kind ('tweet', 'profile', 'set', ...) and carry the time they
+    were written, which lets readers serve stale data while they refresh it. The database
+    runs in WAL mode, and every query runs on one worker thread so it never blocks the event loop.
+    """
+
+    def __init__(self, path: str, fresh_for: float = 60, max_stale: float = 24 * 60 * 60):
+        self.path = path
+        self.fresh_for = fresh_for  # Entries younger than this are served without a refresh
+        self.max_stale = max_stale  # Entries older than this are treated as missing
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(SCHEMA)
+        return self._connection
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _get(self, kind, key):
+        return self._connect().execute(
+            "SELECT value, updated_at FROM entries WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+
+    def _put(self, kind, key, value, updated_at):
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO entries (kind, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (kind, key, value, updated_at),
+        )
+        connection.commit()
+
+    def _delete(self, kind, key):
+        connection = self._connect()
+        connection.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+        connection.commit()
+
+    async def get(self, kind: str, key: str, max_age: float = None):
+        """Return (value, age in seconds), or None if missing or older than ``max_age`` (default ``max_stale``)."""
+        row = await self._run(self._get, kind, str(key))
+        if row is None:
+            return None
+        value, updated_at = row
+        age = time.time() - updated_at
+        if age > (self.max_stale if max_age is None else max_age):
+            return None
+        return json.loads(value), age
+
+    def _items(self, kind):
+        return self._connect().execute(
+            "SELECT key, value FROM entries WHERE kind = ? ORDER BY updated_at", (kind,)
+        ).fetchall()
+
+    async def items(self, kind: str) -> list:
+        """Every (key, value) of a kind, oldest write first. Unlike get(), this ignores ``max_stale``."""
+        rows = await self._run(self._items, kind)
+        return [(key, json.loads(value)) for key, value in rows]
+
+    async def put(self, kind: str, key: str, value, updated_at: float = None):
+        await self._run(self._put, kind, str(key), serializers.dumps(value), updated_at or time.time())
+
+    async def delete(self, kind: str, key: str):
+        await self._run(self._delete, kind, str(key))
+
+    async def close(self):
+        def close():
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        await self._run(close)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+
+from scheduler import RateLimited
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster:
+    """Runs one background poll loop and fans its results out to every subscriber.
+
+    ``poll`` is an async callable returning a list of events (possibly empty). The loop
+    only runs while someone is subscribed, so idle accounts cost no upstream calls.
+    """
+
+    def __init__(self, poll, interval: float = 30, queue_size: int = 100):
+        self.poll = poll
+        self.interval = interval
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._task = None
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, event):
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()  # A stalled subscriber loses its oldest event, not the newest
+            queue.put_nowait(event)
+
+    async def _run(self):
+        while self._subscribers:
+            try:
+                for event in await self.poll():
+                    self.publish(event)
+            except asyncio.CancelledError:
+                raise
+            except RateLimited as e:
+                logger.info("Skipping poll for %s subscribers: %s", type(self).__name__, e)
+            except Exception as e:
+                logger.warning("Error polling for %s subscribers: %s", type(self).__name__, e)
+            await asyncio.sleep(self.interval)
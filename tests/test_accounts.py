@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+import pytest
+from twikit.errors import TooManyRequests
+
+from accounts import Account, AccountPool
+from scheduler import RateLimited
+
+
+class FakeClient:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    async def search_user(self, query):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return [query]
+
+
+def too_many_requests(reset_in: float):
+    reset = int(time.time() + reset_in)
+    return TooManyRequests("Rate limit exceeded", headers={'x-rate-limit-reset': str(reset)})
+
+
+def test_call_moves_to_the_next_account_when_limited():
+    a = Account('a', FakeClient(error=too_many_requests(60)))
+    b = Account('b', FakeClient())
+    pool = AccountPool([a, b])
+
+    assert asyncio.run(pool.call('search_user', 'x')) == ['x']
+    assert not a.available('search_user')
+    assert asyncio.run(pool.call('search_user', 'y')) == ['y']
+    assert a.client.calls == 1  # Skipped while its window is open
+
+
+def test_call_moves_on_when_the_scheduler_refuses():
+    a = Account('a', FakeClient(error=RateLimited('SearchTimeline', 600)))
+    b = Account('b', FakeClient())
+    pool = AccountPool([a, b])
+
+    assert asyncio.run(pool.call('search_user', 'x')) == ['x']
+    assert a.limited_until['search_user'] > time.time() + 500
+
+
+@pytest.mark.parametrize('error', [too_many_requests(60), RateLimited('SearchTimeline', 60)])
+def test_call_gives_up_once_every_account_was_tried(error):
+    # a is already limited for longer than b's window, so b is picked first and fails; before
+    # the fix the pool then kept picking b and never returned
+    a = Account('a', FakeClient(error=too_many_requests(600)))
+    a.mark_limited('search_user', time.time() + 600)
+    b = Account('b', FakeClient(error=error))
+    pool = AccountPool([a, b])
+
+    with pytest.raises((TooManyRequests, RateLimited)):
+        asyncio.run(asyncio.wait_for(pool.call('search_user', 'x'), 3))
+    assert a.client.calls == 1
+    assert b.client.calls == 1
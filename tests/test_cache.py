@@ -0,0 +1,44 @@
+import asyncio
+
+from cache import BookmarkIndex
+
+
+class Page(list):
+    next_cursor = None
+
+
+class Bookmark:
+    def __init__(self, tweet_id):
+        self.id = tweet_id
+
+
+class FlakyClient:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    async def get_bookmarks(self, count, cursor=None):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Twitter is having a moment")
+        return Page([Bookmark('1')])
+
+
+def test_failed_first_load_is_retried_soon_not_after_the_ttl():
+    async def main():
+        bookmarks = BookmarkIndex(ttl=300, retry_after_error=0.05)
+        client = FlakyClient(failures=1)
+        await bookmarks.ensure_fresh(client)
+        loaded_after_failure = bookmarks.contains('1')
+        await bookmarks.ensure_fresh(client)  # Backing off: no second call yet
+        calls_while_backing_off = client.calls
+        await asyncio.sleep(0.06)
+        await bookmarks.ensure_fresh(client)
+        return loaded_after_failure, calls_while_backing_off, client.calls, bookmarks.contains('1')
+
+    loaded_after_failure, calls_while_backing_off, calls, loaded = asyncio.run(main())
+    assert not loaded_after_failure
+    assert calls_while_backing_off == 1
+    assert calls == 2
+    assert loaded
@@ -0,0 +1,62 @@
+import asyncio
+
+from dms import Conversation, DirectMessages
+from notifications import NotificationFeed
+
+
+class Page(list):
+    def __init__(self, items, next_cursor):
+        super().__init__(items)
+        self.next_cursor = next_cursor
+
+
+class Item:
+    def __init__(self, item_id: int):
+        self.id = str(item_id)
+        self.sender_id = '1'
+        self.recipient_id = '2'
+        self.text = self.message = f"item {item_id}"
+        self.time = '0'
+        self.from_user = None
+        self.tweet = None
+
+
+def pages_from(newest: int, page_size: int = 2):
+    """Pages of endless history, newest first: page N starts ``page_size * N`` below ``newest``."""
+    def page(cursor):
+        start = newest - int(cursor or 0)
+        return Page([Item(start - offset) for offset in range(page_size)], str(int(cursor or 0) + page_size))
+    return page
+
+
+class FakeClient:
+    def __init__(self, newest: int):
+        self.page = pages_from(newest)
+        self.calls = 0
+
+    async def get_notifications(self, kind, count, cursor=None):
+        self.calls += 1
+        return self.page(cursor)
+
+    async def get_dm_history(self, user_id, max_id=None):
+        self.calls += 1
+        return self.page(max_id)
+
+
+def test_notifications_fetch_no_more_than_max_pages():
+    feed = NotificationFeed(max_pages=3)
+    feed._push({'id': '1', 'message': 'old'})
+    client = FakeClient(newest=100)
+    new_items = asyncio.run(feed._fetch_new(client))
+    assert client.calls == 3
+    assert len(new_items) == 6
+
+
+def test_dm_sync_fetches_no_more_than_max_pages():
+    dms = DirectMessages(max_pages=3)
+    conversation = Conversation([{'id': '1'}], synced_id='1')
+    client = FakeClient(newest=100)
+    new_messages = asyncio.run(dms._fetch_newer(client, '2', conversation))
+    assert client.calls == 3
+    assert len(new_messages) == 6
+    assert [message['id'] for message in conversation.messages] == [str(i) for i in range(100, 94, -1)]
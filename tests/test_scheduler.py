@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import pytest
+
+from cache import SingleFlight
+from scheduler import BACKGROUND, INLINE, READ, RateLimited, RateLimitScheduler, priority
+
+
+async def call(scheduler, level, method='get_tweet_by_id'):
+    async def fetch():
+        return level
+
+    with priority(level):
+        return await scheduler.run(method, fetch)
+
+
+def test_reserve_is_kept_for_user_facing_calls():
+    async def main():
+        scheduler = RateLimitScheduler(background_reserve=0.2)
+        scheduler.record('TweetDetail', 150, 10, time.time() + 600)
+        assert await call(scheduler, READ) == READ
+        with pytest.raises(RateLimited):
+            await call(scheduler, INLINE)  # A page is waiting: fail fast
+        background = asyncio.create_task(call(scheduler, BACKGROUND))
+        await asyncio.sleep(0.1)
+        assert not background.done()  # Nothing is waiting: hold it until the window resets
+        background.cancel()
+
+    asyncio.run(main())
+
+
+def test_background_call_runs_once_the_window_resets():
+    async def main():
+        scheduler = RateLimitScheduler()
+        scheduler.record('TweetDetail', 150, 0, time.time() + 0.2)
+        started = time.monotonic()
+        assert await call(scheduler, BACKGROUND) == BACKGROUND
+        assert time.monotonic() - started >= 0.15
+
+    asyncio.run(main())
+
+
+def test_user_facing_call_does_not_wait_out_a_long_window():
+    async def main():
+        scheduler = RateLimitScheduler(max_wait=10)
+        scheduler.record('TweetDetail', 150, 0, time.time() + 600)
+        with pytest.raises(RateLimited):
+            await call(scheduler, READ)
+
+    asyncio.run(main())
+
+
+def test_single_flight_only_shares_calls_at_the_same_priority():
+    async def main():
+        flights = SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def fetch(tweet_id):
+            calls.append(tweet_id)
+            await release.wait()
+            return tweet_id
+
+        async def at(level):
+            with priority(level):
+                return await flights.do('get_tweet_by_id', fetch, '1')
+
+        tasks = [asyncio.create_task(at(level)) for level in (BACKGROUND, READ, READ)]
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(*tasks) == ['1', '1', '1']
+        assert len(calls) == 2  # The reads shared one call, but not the background one
+        assert flights.shared == 1
+
+    asyncio.run(main())
@@ -0,0 +1,12 @@
+from search_index import SearchIndex
+
+
+def test_update_changes_the_stored_copy_only():
+    index = SearchIndex()
+    served = {'id': '1', 'text': 'hello world', 'author': 'A', 'username': 'a', 'is_liked': False}
+    index.add(served)
+    index.update('1', is_liked=True)
+    index.update('2', is_liked=True)  # Not indexed: ignored
+    assert index.search('hello')[0]['is_liked'] is True
+    assert served['is_liked'] is False
+    assert '2' not in index
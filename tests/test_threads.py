@@ -0,0 +1,43 @@
+import asyncio
+
+from scheduler import INLINE, _priority
+from threads import ThreadWalker
+
+
+class Tweet:
+    def __init__(self, tweet_id: int, fanout: int):
+        self.id = str(tweet_id)
+        self.in_reply_to = None
+        self.reply_to = None
+        self.reply_count = fanout
+        # Every tweet has ``fanout`` replies, so the thread is as big as the limits allow
+        self.replies = [ReplyStub(tweet_id * 10 + index, fanout) for index in range(1, fanout + 1)]
+
+
+class ReplyStub:
+    def __init__(self, tweet_id: int, fanout: int):
+        self.id = str(tweet_id)
+        self.reply_count = fanout
+
+
+def test_walk_stops_at_its_fetch_budget_and_runs_inline():
+    fetches = []
+
+    async def get_tweet(tweet_id):
+        fetches.append(_priority.get())
+        return Tweet(int(tweet_id), 3)
+
+    async def more_replies(tweet_id, cursor):
+        raise AssertionError("replies fit on one page")
+
+    async def main():
+        walker = ThreadWalker(get_tweet, more_replies, max_depth=6, max_size=1000, max_fetches=10)
+        state = {}
+        levels = [level async for _, level in walker.levels(Tweet(1, 3), state)]
+        return levels, state
+
+    levels, state = asyncio.run(main())
+    assert len(fetches) == 10
+    assert set(fetches) == {INLINE}
+    assert state['truncated']
+    assert len(levels) == 3  # 3 replies, then 9 fetched, then the 1 fetch left
@@ -0,0 +1,65 @@
+import asyncio
+
+from store import Store
+from writebehind import DONE, PENDING, WriteBehindQueue
+
+
+class FakeClient:
+    def __init__(self, failures: int = 0):
+        self.failures = failures  # Calls that fail before Twitter starts accepting them
+        self.performed = []
+        self.background_tasks = set()
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def invalidate_tweet(self, tweet_id):
+        pass
+
+    def mark_liked(self, tweet_id, liked):
+        pass
+
+    async def perform_action(self, action, target):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Twitter is having a moment")
+        self.performed.append((action, target))
+
+
+def test_enqueue_returns_once_the_entry_is_on_disk(tmp_path):
+    async def main():
+        store = Store(str(tmp_path / "cache.db"))
+        queue = WriteBehindQueue(FakeClient(failures=1), store=store, base_delay=60)
+        entry = await queue.enqueue('like', '1')
+        saved = await store.get('write', entry['key'])
+        await queue.stop()
+        await store.close()
+        return saved
+
+    saved = asyncio.run(main())
+    assert saved is not None
+    assert saved[0]['action'] == 'like' and saved[0]['status'] == PENDING
+
+
+def test_retried_like_stays_ahead_of_the_unlike_queued_behind_it():
+    async def main():
+        client = FakeClient(failures=1)
+        queue = WriteBehindQueue(client, base_delay=0.1)
+        like = await queue.enqueue('like', '1')
+        await asyncio.sleep(0.01)  # The like's first attempt fails and backs off
+        unlike = await queue.enqueue('unlike', '1')
+        await asyncio.wait_for(_until_done(queue), 3)
+        await queue.stop()
+        return client.performed, like, unlike
+
+    performed, like, unlike = asyncio.run(main())
+    assert performed == [('like', '1'), ('unlike', '1')]
+    assert like['status'] == unlike['status'] == DONE
+
+
+async def _until_done(queue):
+    while queue.status()[PENDING]:
+        await asyncio.sleep(0.01)
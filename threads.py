@@ -0,0 +1,128 @@
+import asyncio
+
+from scheduler import INLINE, current_priority, priority
+
+
+async def collect_replies(replies, limit: int, fetch_page, max_pages: int = 5):
+    """Read up to ``limit`` tweets from a twikit replies Result, following its pages.
+
+    ``fetch_page`` is an async callable taking a cursor and returning the next Result, so
+    follow-up pages go through the scheduler rather than the Result's own ``next()``.
+    Returns (tweets, the Result the last tweet came from); its ``next_cursor`` continues
+    from where this stopped.
+    """
+    tweets = list(replies or [])
+    page = replies
+    pages = 1
+    while page is not None and len(tweets) < limit and pages < max_pages and getattr(page, 'next_cursor', None):
+        page = await fetch_page(page.next_cursor)
+        if not page:
+            break
+        tweets += list(page)
+        pages += 1
+    return tweets[:limit], page
+
+
+class ThreadWalker:
+    """Rebuilds the conversation around a tweet: every ancestor, then descendants level by level.
+
+    ``get_tweet`` is an async callable returning a twikit Tweet by ID, usually through the
+    tweet cache, and ``more_replies`` one taking (tweet ID, cursor) and returning the next
+    page of its replies. Twitter's TweetDetail response already carries a tweet's ancestors
+    (``tweet.reply_to``), so the chain up usually costs nothing extra. The walk down fetches
+    every reply that has replies of its own concurrently, one depth at a time, stopping at
+    ``max_depth`` levels, ``max_size`` tweets or ``max_fetches`` upstream requests. Those
+    requests run at INLINE priority, so one big thread can't spend the TweetDetail budget
+    the rest of the app needs.
+    """
+
+    def __init__(self, get_tweet, more_replies, max_depth: int = 4, max_size: int = 200, max_ancestors: int = 50,
+                 max_concurrent: int = 8, pages_per_tweet: int = 3, max_fetches: int = 25):
+        self.get_tweet = get_tweet
+        self.more_replies = more_replies
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self.max_fetches = max_fetches
+        self.max_ancestors = max_ancestors
+        self.pages_per_tweet = pages_per_tweet
+        self._limit = asyncio.Semaphore(max_concurrent)
+
+    async def ancestors(self, tweet) -> list:
+        """The tweets ``tweet`` replies to, root first."""
+        chain = list(getattr(tweet, 'reply_to', None) or [])
+        oldest = chain[0] if chain else tweet
+        # reply_to can be missing or cut short; climb the rest of the way ourselves
+        while oldest.in_reply_to and len(chain) < self.max_ancestors:
+            try:
+                parent = await self.get_tweet(oldest.in_reply_to)
+            except Exception:
+                break  # Deleted or protected: the visible thread starts here
+            chain = list(getattr(parent, 'reply_to', None) or []) + [parent] + chain
+            oldest = chain[0]
+        return chain[-self.max_ancestors:]
+
+    async def _children(self, tweet, fetch: bool, budget: int, state: dict) -> list:
+        if fetch:
+            async with self._limit:
+                tweet = await self.get_tweet(tweet.id)
+
+        async def more_replies(cursor):
+            if state['fetches_left'] <= 0:
+                state['truncated'] = True
+                return None
+            state['fetches_left'] -= 1
+            return await self.more_replies(tweet.id, cursor)
+
+        children, _ = await collect_replies(
+            getattr(tweet, 'replies', None), budget, more_replies, self.pages_per_tweet,
+        )
+        return children
+
+    async def levels(self, tweet, state: dict = None):
+        """Yield (depth, [(parent_id, reply), ...]) for each level below ``tweet``, nearest first.
+
+        When the walk stops at a limit with replies left unread, ``state['truncated']`` is set.
+        """
+        state = state if state is not None else {}
+        state['truncated'] = False
+        state['fetches_left'] = self.max_fetches
+        seen = {tweet.id}
+        size = 0
+        frontier = [tweet]
+        for depth in range(1, self.max_depth + 1):
+            budget = self.max_size - size
+            # The root came with its replies; deeper tweets need their own TweetDetail request
+            if depth > 1:
+                if len(frontier) > state['fetches_left']:
+                    frontier = frontier[:state['fetches_left']]
+                    state['truncated'] = True
+                if not frontier:
+                    return
+                state['fetches_left'] -= len(frontier)
+            with priority(max(current_priority(), INLINE)):
+                results = await asyncio.gather(
+                    *(self._children(parent, fetch=depth > 1, budget=budget, state=state) for parent in frontier),
+                    return_exceptions=True,
+                )
+            level = []
+            for parent, children in zip(frontier, results):
+                if isinstance(children, Exception):
+                    continue  # One unavailable branch shouldn't lose the rest of the thread
+                for child in children:
+                    if child.id not in seen:
+                        seen.add(child.id)
+                        level.append((parent.id, child))
+            if len(level) > budget:
+                level = level[:budget]
+                state['truncated'] = True
+            if not level:
+                return
+            size += len(level)
+            yield depth, level
+            if size >= self.max_size:
+                state['truncated'] = True
+                return
+            frontier = [child for _, child in level if child.reply_count]
+            if not frontier:
+                return
+        state['truncated'] = True  # Deeper replies exist but are past max_depth
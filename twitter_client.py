@@ -1,30 +1,111 @@
-import json
+import asyncio
+import logging
 from twikit import Client
-
-bookmarkedTweets = []
-loggedUser = {}
-
-
+from accounts import Account, AccountPool, account_name, load_cookies
+from dms import DirectMessages, serialize_message
+from cache import BookmarkIndex, CurrentUser, FollowingSet, LRUCache, SingleFlight, TweetCache, UserDirectory
+from media import MediaCache, MediaUploader, MediaUploadError
+from metrics import instrument
+from serializers import DETAIL, FEED, REPLY, serialize_tweets
+from notifications import NotificationFeed
+from search_index import SearchIndex
+from streams import Broadcaster
+from threads import ThreadWalker, collect_replies
+from scheduler import BACKGROUND, INLINE, RateLimitScheduler, ScheduledClient, current_priority, priority
+from store import Store
+from writebehind import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+# Seconds an optional part of a page may take before the page is served without it
+BRANCH_TIMEOUTS = {
+    'bookmarks': 2.0,  # is_bookmarked falls back to what the index already holds
+    'following': 2.0,  # is_followed likewise
+    'viewer': 2.0,  # Our own user ID, for is_followable
+    'parents': 3.0,  # The tweets replies point at
+    'users': 4.0,  # The user half of a search
+    'tweets': 6.0,  # A profile's tweets
+}
+
+# Seconds a page request waits for the background prefetch of that page before fetching it itself
+PREFETCH_WAIT = 3.0
+
+# Engagement action name (/batch, write-behind queue) -> the TwitterClient method that performs it on one tweet or user ID
+ACTIONS = {
+    'like': 'like_tweet',
+    'unlike': 'unlike_tweet',
+    'bookmark': 'bookmark_tweet',
+    'unbookmark': 'unbookmark_tweet',
+    'retweet': 'retweet',
+    'follow': 'follow_user',
+    'unfollow': 'unfollow_user',
+    'block': 'block_user',
+    'unblock': 'unblock_user',
+}
+
+
+@instrument
 class TwitterClient:
     """Wrapper around the Twikit Client for interacting with Twitter."""
 
-    def __init__(self, cookie_file: str):
-        """Initialize the client with cookies loaded from a JSON file."""
-        with open(cookie_file, "r") as file:
-            cookies = json.load(file)  # Load cookies from the JSON file
-        self.client = Client(language='en-US', cookies=cookies)  # Pass cookies to the Client
+    def __init__(self, cookie_file: str, readers: AccountPool = None, store: Store = None, client=None):
+        """Initialize the client with cookies loaded from a JSON file.
+
+        ``readers`` is the pool of accounts that read-only lookups may be spread across;
+        by default it holds only this account. ``store`` is an optional on-disk cache that
+        tweets, profiles and the bookmark/following sets are kept in across restarts.
+        ``client`` replaces the twikit Client (and the cookie file isn't read), e.g. the
+        fake backend in bench.py.
+        """
+        if client is None:
+            cookies = load_cookies(cookie_file)  # Load cookies from the JSON file
+            client = Client(language='en-US', cookies=cookies)  # Pass cookies to the Client
+        self.scheduler = RateLimitScheduler()  # Rate limits are per account, so each client has its own
+        self.client = ScheduledClient(client, self.scheduler)
+        self.account = Account(account_name(cookie_file), self.client)
+        self.readers = readers or AccountPool([self.account])
+        self.bookmarks = BookmarkIndex()  # Shared bookmark state for every serializer
+        self.following = FollowingSet()  # IDs of the accounts we follow
+        self.me = CurrentUser()  # The logged-in account's own profile
+        self.users = UserDirectory()  # Screen name <-> user ID for everyone we've seen
+        self.following.on_page = self.users.remember_many
+        self.hydration_limit = asyncio.Semaphore(8)  # Max parent tweets fetched at once
+        self.tweets = TweetCache()  # Recently fetched Tweet objects
+        self.flights = SingleFlight()  # Identical upstream reads currently in progress
+        # Concurrent image uploads for new tweets. Media IDs only work for the account that
+        # uploaded them, so each account keeps its own cache file
+        self.uploader = MediaUploader(self.client, cache=MediaCache(f"media_cache.{self.account.name}.json"))
+        self.feed_pages = LRUCache(max_size=50, ttl=120)  # (cursor, count) -> fetched home feed page
+        self.feed_prefetches = {}  # (cursor, count) -> background task fetching that page
+        self.timeline_stream = Broadcaster(self.poll_new_tweets, interval=30)  # Live home feed for every open tab
+        self.newest_tweet_id = None  # Newest timeline tweet the live feed has seen
+        self.search_index = SearchIndex()  # Every tweet we've served, searchable offline
+        self.threads = ThreadWalker(self.get_tweet_by_id, self.get_more_replies)  # Whole conversations, fetched level by level
+        self.notifications = NotificationFeed()  # Recent notifications, fetched incrementally
+        self.store = store
+        self.dms = DirectMessages(store=store, spawn=self.spawn)  # Local copy of DM conversations, synced incrementally
+        self.dm_stream = Broadcaster(self.poll_new_messages, interval=10)  # New DMs for every open chat, in every tab
+        self.watched_conversations = {}  # Other user's ID -> number of open chats showing that conversation
+        self.tweet_profiles = LRUCache(max_size=10000, ttl=24 * 60 * 60)  # Tweet ID -> stored profile keys showing it
+        self.revalidations = {}  # (kind, key) -> background refresh of a stale stored entry
+        self.background_tasks = set()
+        self.write_queue = None  # WriteBehindQueue, when engagement actions are acknowledged before Twitter sees them
+        if store is not None:
+            self.bookmarks.on_refresh = lambda ids: self.persist('set', 'bookmarks', sorted(ids))
+            self.following.on_refresh = lambda ids: self.persist('set', 'following', sorted(ids))
         
 
     async def create_tweet(self, content: str, image_paths: list = [], alt_texts: list = [], reply_to: str = None, attachment_url: str = None):
         """Post a tweet using the Twikit Client, optionally quoting another tweet."""
-        print(f"Quoting tweet with URL: {attachment_url}")
+        logger.debug("Creating tweet (reply_to=%s, quoting=%s)", reply_to, attachment_url)
         try:
             media_id = []
 
             # If images are provided, upload the images and get the media IDs
-            if image_paths:
-                image_paths = [x for x in image_paths if x]
-                media_id = await self.upload_media(image_paths, alt_texts)
+            if any(image_paths or []):
+                # Upload by slot, so a failure names the image as the form numbered it
+                media_ids = await self.upload_media(image_paths, alt_texts)
+                media_id = [media_id for media_id in media_ids if media_id is not None]
 
             # Post the tweet with media, reply-to, or quoted tweet
             if attachment_url:
@@ -56,153 +137,337 @@ class TwitterClient:
                     )
 
             return response  # Return the response (tweet object or ID)
+        except MediaUploadError:
+            raise  # Keep the media IDs that did upload, so the caller can retry with just the failed slots
         except Exception as e:
             raise RuntimeError(f"Error posting tweet: {e}")
         
+    async def quote_tweet(self, content: str, image_paths: list = [], alt_texts: list = [], attachment_url: str = None):
+        """Quote a tweet, going through the same image pipeline as create_tweet."""
+        return await self.create_tweet(content, image_paths, alt_texts, attachment_url=attachment_url)
+
     async def retweet(self, tweet_id: str):
         try:
             response = await self.client.retweet(
                 tweet_id=tweet_id
             )
+            self.invalidate_tweet(tweet_id)
             return response  # Return the response (tweet object or ID)
         except Exception as e:
             raise RuntimeError(f"Error retweeting: {e}")
 
     async def upload_media(self, image_paths: list = [], alt_texts: list = []):
-        """Upload an image to Twitter and return the media ID."""
+        """Upload images to Twitter concurrently and return their media IDs in order."""
         try:
-            # Upload the image to Twitter
-            media_response = []
-            for image_path in image_paths:
-                media_response.append(await self.client.upload_media(image_path))
-
-            # If alt text is provided, set it for the image
-            if alt_texts:
-                for index, image_path in enumerate(image_paths):
-                    await self.client.create_media_metadata(
-                        media_id=media_response[index],
-                        alt_text=alt_texts[index],
-                    )
-            else:
-                await self.client.create_media_metadata(
-                    media_id=media_response[0],
-                )
-            return media_response  # Return the media ID
-
+            return await self.uploader.upload(image_paths, alt_texts)
+        except MediaUploadError:
+            raise  # Already names the failed images and carries the successful media IDs
         except Exception as e:
             raise RuntimeError(f"Error uploading media: {e}")
-
-    async def get_home_feed(self, count: int = 20, seen_tweet_ids: list[str] = None, cursor: str = None):
+        
+    def spawn(self, coroutine):
+        """Run a coroutine in the background, keeping a reference so it isn't garbage collected."""
+        task = asyncio.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def persist(self, kind: str, key: str, value):
+        """Write an entry to the on-disk store in the background, if there is one."""
+        if self.store is not None:
+            self.spawn(self.store.put(kind, key, value))
+
+    def forget(self, kind: str, key: str):
+        if self.store is not None:
+            self.spawn(self.store.delete(kind, key))
+
+    async def warm_from_store(self):
+        """Load the bookmark and following sets saved by a previous run."""
+        if self.store is None:
+            return
+        for name, id_set in (('bookmarks', self.bookmarks), ('following', self.following)):
+            entry = await self.store.get('set', name)
+            if entry is not None:
+                ids, age = entry
+                id_set.seed(ids, age=age)
+
+    async def cached_read(self, kind: str, key: str, fetch):
+        """Return ``await fetch()`` through the on-disk store, stale-while-revalidate.
+
+        A fresh stored entry is returned as is. A stale one is returned too, but a refresh
+        starts in the background. A missing one is fetched and then saved.
+        """
+        if self.store is None:
+            return await fetch()
+        entry = await self.store.get(kind, key)
+        if entry is None:
+            value = await fetch()
+            if not (isinstance(value, dict) and value.get('partial')):  # Don't keep a degraded page
+                self.persist(kind, key, value)
+            return value
+
+        value, age = entry
+        if age > self.store.fresh_for and (kind, key) not in self.revalidations:
+            async def revalidate():
+                try:
+                    with priority(BACKGROUND):
+                        fresh = await fetch()
+                    if not (isinstance(fresh, dict) and fresh.get('partial')):
+                        await self.store.put(kind, key, fresh)
+                except Exception as e:
+                    logger.warning("Error refreshing stored %s %s: %s", kind, key, e)
+                finally:
+                    self.revalidations.pop((kind, key), None)
+
+            self.revalidations[(kind, key)] = self.spawn(revalidate())
+        return value
+
+    def invalidate_tweet(self, tweet_id):
+        """Drop every cached copy of a tweet after we change its like/retweet/bookmark state."""
+        self.tweets.invalidate(tweet_id)
+        self.forget('tweet', tweet_id)
+        # Stored profile pages carry the tweet's is_liked too, and would be served as is for fresh_for seconds
+        for profile_key in self.tweet_profiles.peek(str(tweet_id)) or ():
+            self.forget('profile', profile_key)
+
+    def mark_liked(self, tweet_id, liked: bool):
+        """Record our like or unlike in the local search index, whose copy otherwise keeps the old is_liked."""
+        tweet_data = self.search_index.get(tweet_id)
+        if tweet_data is None or tweet_data.get('is_liked') == liked:
+            return
+        fields = {'is_liked': liked}
+        if tweet_data.get('likes_count') is not None:
+            fields['likes_count'] = max(0, tweet_data['likes_count'] + (1 if liked else -1))
+        self.search_index.update(tweet_id, **fields)
+
+    async def branch(self, name: str, awaitable, timeout: float, degraded: list, default=None):
+        """Await one optional part of a page for at most ``timeout`` seconds.
+
+        If it fails or runs late, ``name`` is added to ``degraded`` and ``default`` returned,
+        so the page is served without it. Late work keeps running in the background, so
+        whatever cache it fills is warm for the next request.
+        """
+        task = asyncio.ensure_future(awaitable)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except Exception as e:
+            degraded.append(name)
+            if not task.done():
+                self.background_tasks.add(task)
+                task.add_done_callback(self.background_tasks.discard)
+                task.add_done_callback(lambda task: task.cancelled() or task.exception())  # Don't warn on late failures
+            logger.info("Serving without %s: %s", name, str(e) or type(e).__name__)
+            return default
+
+    async def coalesced(self, method: str, *args, **kwargs):
+        """Call a twikit Client read method, sharing one request between identical concurrent calls."""
+        return await self.flights.do(method, getattr(self.client, method), *args, **kwargs)
+
+    async def pooled(self, method: str, *args, **kwargs):
+        """Like coalesced(), but the call may run on any account in the reader pool.
+
+        Only use this for lookups whose result doesn't depend on who is asking: tweets carry
+        per-viewer state such as ``favorited``, so they always go through this account.
+        """
+        return await self.flights.do(f"pooled:{method}", self.readers.call, method, *args, **kwargs)
+
+    async def get_tweet_by_id(self, tweet_id):
+        """Fetch a Tweet object, served from the tweet cache when we have a fresh copy."""
+        tweet = self.tweets.get(tweet_id)
+        if tweet is None:
+            tweet = await self.coalesced('get_tweet_by_id', tweet_id)
+            self.tweets.put(tweet)
+        return tweet
+
+    def serialize(self, tweets, profile=FEED, parents=None) -> list:
+        """Serialize tweets with this account's bookmark state and add them to the local search index."""
+        serialised_tweets = serialize_tweets(tweets, profile, bookmarks=self.bookmarks, parents=parents)
+        self.search_index.add_many(serialised_tweets)
+        for tweet in tweets:
+            self.users.remember(tweet.user)
+            if tweet.quote is not None:
+                self.users.remember(tweet.quote.user)
+        for parent in (parents or {}).values():
+            if not isinstance(parent, Exception):
+                self.users.remember(parent.user)
+        return serialised_tweets
+
+    async def lookup_user(self, username):
+        """Fetch a twikit User by screen name from any account in the pool, remembering its ID."""
+        user = await self.pooled('get_user_by_screen_name', username)
+        self.users.remember(user)
+        return user
+
+    async def resolve_user_id(self, username) -> str:
+        """The user ID behind a screen name, from the user directory when we've seen them before."""
+        user_id = self.users.id_for(username)
+        if user_id is None:
+            user_id = str((await self.lookup_user(username.lstrip('@'))).id)
+        return user_id
+
+    async def resolve_users(self, usernames: list = (), user_ids: list = (), max_concurrent: int = 8):
+        """Map many screen names to IDs and IDs to screen names, looking up only the ones we haven't seen.
+
+        Returns {'user_ids': {name: id}, 'usernames': {id: name}, 'errors': {name or id: message}}.
+        """
+        limit = asyncio.Semaphore(max_concurrent)
+        resolved = {'user_ids': {}, 'usernames': {}, 'errors': {}}
+
+        async def by_name(spellings):
+            try:
+                async with limit:
+                    user_id = await self.resolve_user_id(spellings[0])
+                for username in spellings:
+                    resolved['user_ids'][username] = user_id
+            except Exception as e:
+                for username in spellings:
+                    resolved['errors'][username] = str(e)
+
+        # 'Alice', 'alice' and '@alice' are one lookup
+        spellings_by_name = {}
+        for username in usernames:
+            spellings_by_name.setdefault(username.lstrip('@').lower(), []).append(username)
+
+        async def by_id(user_id):
+            try:
+                username = self.users.name_for(user_id)
+                if username is None:
+                    async with limit:
+                        user = await self.pooled('get_user_by_id', user_id)
+                    self.users.remember(user)
+                    username = user.screen_name
+                resolved['usernames'][user_id] = username
+            except Exception as e:
+                resolved['errors'][user_id] = str(e)
+
+        await asyncio.gather(
+            *(by_name(spellings) for spellings in spellings_by_name.values()),
+            *(by_id(str(user_id)) for user_id in dict.fromkeys(user_ids)),
+        )
+        return resolved
+
+    async def fetch_parent_tweets(self, tweets) -> dict:
+        """Fetch the tweets a page of replies points at, concurrently and once per parent.
+
+        Returns a dict mapping parent tweet ID to the Tweet, or to the exception raised fetching it.
+        """
+        parent_ids = list(dict.fromkeys(tweet.in_reply_to for tweet in tweets if tweet.in_reply_to))
+
+        async def fetch(parent_id):
+            async with self.hydration_limit:
+                return await self.get_tweet_by_id(parent_id)
+
+        # INLINE when a page is waiting on the parents, so they fail fast in the reserve instead of
+        # sleeping until the window resets; a prefetch or poll keeps its BACKGROUND level
+        with priority(max(current_priority(), INLINE)):
+            results = await asyncio.gather(*(fetch(parent_id) for parent_id in parent_ids), return_exceptions=True)
+        return dict(zip(parent_ids, results))
+
+    async def fetch_home_page(self, count: int = 20, seen_tweet_ids: list[str] = None, cursor: str = None):
+        """Fetch one page of the home timeline with its reply parents, as (tweets, next_cursor, parent_tweets)."""
+        timeline_result = await self.coalesced(
+            'get_latest_timeline',
+            count=count,
+            seen_tweet_ids=seen_tweet_ids,
+            cursor=cursor,
+        )
+        if not timeline_result:
+            raise RuntimeError("Twikit returned no tweets. Check your authentication.")
+        parent_tweets = await self.fetch_parent_tweets(timeline_result)
+        return list(timeline_result), timeline_result.next_cursor, parent_tweets
+
+    def prefetch_home_page(self, cursor: str, count: int = 20):
+        """Start fetching the page after ``cursor`` in the background, unless we already have it."""
+        key = (cursor, count)
+        if not cursor or key in self.feed_pages or key in self.feed_prefetches:
+            return
+
+        async def prefetch():
+            try:
+                with priority(BACKGROUND):
+                    self.feed_pages.set(key, await self.fetch_home_page(count=count, cursor=cursor))
+            except Exception as e:
+                logger.warning("Error prefetching home feed page: %s", e)
+            finally:
+                self.feed_prefetches.pop(key, None)
+
+        self.feed_prefetches[key] = asyncio.create_task(prefetch())
+
+    async def poll_new_tweets(self, count: int = 20) -> list:
+        """Fetch the top of the home timeline and return the tweets newer than the last poll, serialized.
+
+        The first poll only records where the timeline starts, since the page is already on screen.
+        """
+        with priority(BACKGROUND):
+            timeline_result = await self.coalesced('get_latest_timeline', count=count)
+        newest_id = self.newest_tweet_id
+        new_tweets = [tweet for tweet in timeline_result if newest_id is None or int(tweet.id) > newest_id]
+        if new_tweets:
+            self.newest_tweet_id = max(int(tweet.id) for tweet in new_tweets)
+        if newest_id is None or not new_tweets:
+            return []
+
+        await self.bookmarks.ensure_fresh(self.client)
+        parent_tweets = await self.fetch_parent_tweets(new_tweets)
+        return [{'tweets': self.serialize(new_tweets, FEED, parents=parent_tweets)}]
+
+    async def get_home_feed(self, count: int = 20, seen_tweet_ids: list[str] = None, cursor: str = None, prefetch: bool = True):
         """Fetch the home timeline using async get_latest_timeline."""
         try:
-            bookmarkedTweets = await self.client.get_bookmarks(count=count)
-            # Fetch the timeline using the Twikit method
-            timeline_result = await self.client.get_latest_timeline(
-                count=count,
-                seen_tweet_ids=seen_tweet_ids,
-                cursor=cursor,
-            )
-            tweets = timeline_result  # Extract the list of Tweet objects
-            if not timeline_result:
-                raise RuntimeError("Twikit returned no tweets. Check your authentication.")
-
-            # Serialize tweets to a JSON-compatible format
-            serialised_tweets = []
-            for tweet in tweets:
-                tweet_data = {
-                    'id': tweet.id,
-                    'text': tweet.text,
-                    'author': tweet.user.name,
-                    'username': tweet.user.screen_name,
-                    'created_at': tweet.created_at.isoformat() if hasattr(tweet.created_at, 'isoformat') else str(tweet.created_at),
-                    'is_quote': tweet.is_quote_status,
-                    'in_reply_to': tweet.in_reply_to is not None,
-                    'is_liked': tweet.favorited,
-                }
-
-                # Handle quotes
-                if tweet.is_quote_status == True and tweet.quote is not None:
+            await self.bookmarks.ensure_fresh(self.client)
+
+            # Older pages don't change, so pages behind a cursor are served from the page cache.
+            # The newest page (no cursor) and requests excluding seen tweets always go upstream.
+            key = (cursor, count)
+            page = None
+            if cursor and not seen_tweet_ids:
+                page = self.feed_pages.get(key)
+                if page is None and key in self.feed_prefetches:
+                    # Finish the prefetch already running, unless it is held back by the rate limit
                     try:
-                        tweet_data['quoted_tweet'] = {
-                            'id': tweet.quote.id,
-                            'text': tweet.quote.full_text,
-                            'author': tweet.quote.user.name,
-                            'username': tweet.quote.user.screen_name,
-                            'created_at': tweet.quote.created_at.isoformat() if hasattr(tweet.quote.created_at, 'isoformat') else str(tweet.quote.created_at),
-                        }
-                    except Exception as e:
-                        tweet_data['quoted_tweet_error'] = f"Error fetching quoted tweet: {e}"
-                else:
-                    tweet_data['quoted_tweet'] = None  # Ensure this key exists even if no quote
+                        await asyncio.wait_for(asyncio.shield(self.feed_prefetches[key]), PREFETCH_WAIT)
+                    except asyncio.TimeoutError:
+                        pass
+                    page = self.feed_pages.get(key)
+            if page is None:
+                page = await self.fetch_home_page(count=count, seen_tweet_ids=seen_tweet_ids, cursor=cursor)
+                if cursor and not seen_tweet_ids:
+                    self.feed_pages.set(key, page)
+            tweets, next_cursor, parent_tweets = page
+
+            # Get the next page ready while the user reads this one
+            if prefetch and next_cursor:
+                self.prefetch_home_page(next_cursor, count)
 
-                # Handle replies
-                if tweet.in_reply_to:
-                    try:
-                        reply_tweet = await self.client.get_tweet_by_id(tweet.in_reply_to)
-                        tweet_data['reply_to'] = {
-                            'id': reply_tweet.id,
-                            'text': reply_tweet.full_text,
-                            'author': reply_tweet.user.name,
-                            'username': reply_tweet.user.screen_name,
-                            'created_at': reply_tweet.created_at.isoformat() if hasattr(reply_tweet.created_at, 'isoformat') else str(reply_tweet.created_at),
-                        }
-                    except Exception as e:
-                        tweet_data['reply_to_error'] = f"Error fetching reply tweet: {e}"
-
-                if hasattr(tweet, 'media') and tweet.media:
-                    media_urls = [media['media_url_https'] for media in tweet.media if 'media_url_https' in media]
-                    tweet_data['media_urls'] = media_urls  # Add media URLs to the tweet data
-                    
-                    
-                #Handle if a tweet is bookmarked
-                for bookmark in bookmarkedTweets:
-                    if tweet.id == bookmark.id:
-                        tweet_data['is_bookmarked'] = True 
-                        print(tweet.id + " " + bookmark.id) 
-                        break
-                    else:
-                        tweet_data['is_bookmarked'] = False
-
-                serialised_tweets.append(tweet_data)
+            # Serialize tweets to a JSON-compatible format
+            serialised_tweets = self.serialize(tweets, FEED, parents=parent_tweets)
                 
         # Return serialized tweets along with pagination cursor
             return {
-                'tweets': serialised_tweets
+                'tweets': serialised_tweets,
+                'next_cursor': next_cursor,
             }
 
         except Exception as e:
             raise RuntimeError(f"Error fetching home feed: {e}")
         
     async def get_bookmarks(self, count: int = 20):
-        """Fetch the home timeline using async get_latest_timeline."""
+        """Fetch the bookmarked tweets using async get_bookmarks."""
         try:
-            # Fetch the timeline using the Twikit method
-            bookmarks_result = await self.client.get_bookmarks(
+            # Fetch the bookmarks using the Twikit method
+            bookmarks_result = await self.coalesced(
+                'get_bookmarks',
                 count=count
             )
             tweets = bookmarks_result  # Extract the list of Tweet objects
             if not bookmarks_result:
                 raise RuntimeError("Twikit returned no bookmarks. Check your authentication.")
 
-            # Serialize tweets to a JSON-compatible format
-            serialised_tweets = []
-            for tweet in tweets:
-                tweet_data = {
-                    'id': tweet.id,
-                    'text': tweet.text,
-                    'author': tweet.user.name,
-                    'username': tweet.user.screen_name,
-                    'created_at': tweet.created_at.isoformat() if hasattr(tweet.created_at, 'isoformat') else str(tweet.created_at),
-                    'quote': tweet.quote,
-                    'is_liked': tweet.favorited,
-                    'is_bookmarked': True,
-                }
-
-                if hasattr(tweet, 'media') and tweet.media:
-                    media_urls = [media['media_url_https'] for media in tweet.media if 'media_url_https' in media]
-                    tweet_data['media_urls'] = media_urls  # Add media URLs to the tweet data
+            # Everything in this feed is bookmarked, so keep the index in step
+            self.bookmarks.update(tweet.id for tweet in tweets)
 
-                serialised_tweets.append(tweet_data)
+            # Serialize tweets to a JSON-compatible format
+            serialised_tweets = self.serialize(tweets, FEED)
                 
         # Return serialized tweets
             return {
@@ -213,51 +478,30 @@ class TwitterClient:
             raise RuntimeError(f"Error fetching home feed: {e}")
         
     async def get_notifications(self, count: int = 20):
-        """Fetch the home timeline using async get_latest_timeline."""
+        """Return the latest notifications from the local buffer, topping it up if it's stale."""
         try:
-            # Fetch the timeline using the Twikit method
-            notifications_result = await self.client.get_notifications(
-                type='All',
-                count=count
-            )
-            notifications = notifications_result  # Extract the list of Tweet objects
-            if not notifications_result:
+            await self.notifications.ensure_fresh(self.client)
+            if not len(self.notifications):
                 raise RuntimeError("Twikit returned no notifications. Check your authentication.")
-
-            # Serialize tweets to a JSON-compatible format
-            serialized_notifications = []
-            for notification in notifications:
-                if notification.from_user:
-                    context_id = notification.tweet.id
-                    print(context_id)
-                    notification_data = {
-                        'id': notification.id,
-                        'message': notification.message,
-                        'from_user': notification.from_user.name,
-                        'context_text': notification.tweet.text,
-                        'context_id': str(context_id),
-                    }
-                else:
-                    notification_data = {
-                        'id': notification.id,
-                        'message': notification.message,
-                    }
-                    
-                serialized_notifications.append(notification_data)
-                print(serialized_notifications)
-        # Return serialized tweets along with pagination cursor
             return {
-                'notifications': serialized_notifications
+                'notifications': self.notifications.latest(count),
+                'unread': self.notifications.unread,
             }
 
         except Exception as e:
             raise RuntimeError(f"Error fetching notifications: {e}")
-            
+
+    def mark_notifications_read(self):
+        self.notifications.mark_read()
+        return {'unread': self.notifications.unread}
+
     async def like_tweet(self, tweet_id: str):
         """Like a tweet using the Twikit Client."""
         try:
             # Send a like to the tweet
             await self.client.favorite_tweet(tweet_id)
+            self.invalidate_tweet(tweet_id)
+            self.mark_liked(tweet_id, True)
         except Exception as e:
             raise RuntimeError(f"Error liking tweet: {e}")
         
@@ -266,6 +510,8 @@ class TwitterClient:
         try:
             # Bookmark the tweet
             await self.client.bookmark_tweet(tweet_id)
+            self.invalidate_tweet(tweet_id)
+            self.bookmarks.add(tweet_id)
         except Exception as e:
             raise RuntimeError(f"Error bookmarking tweet: {e}")
         
@@ -274,6 +520,8 @@ class TwitterClient:
         try:
             # Send a like to the tweet
             await self.client.delete_bookmark(tweet_id)
+            self.invalidate_tweet(tweet_id)
+            self.bookmarks.discard(tweet_id)
         except Exception as e:
             raise RuntimeError(f"Error deleting bookmark: {e}")
         
@@ -282,28 +530,41 @@ class TwitterClient:
         try:
             # Send a like to the tweet
             await self.client.unfavorite_tweet(tweet_id)
+            self.invalidate_tweet(tweet_id)
+            self.mark_liked(tweet_id, False)
         except Exception as e:
             raise RuntimeError(f"Error unliking tweet: {e}")
         
     async def follow_user(self, user_id: str):
         """Follow a user."""
         try:
-            print(f"following user" + user_id)
+            already_following = self.following.contains(user_id)
             await self.client.follow_user(user_id)
+            self.following.add(user_id)
+            if not already_following:
+                self.me.adjust_following(+1)
         except Exception as e:
             raise RuntimeError(f"Error following user: {e}")
         
     async def unfollow_user(self, user_id: str):
         """Unfollow a user."""
         try:
+            was_following = self.following.contains(user_id)
             await self.client.unfollow_user(user_id)
+            self.following.discard(user_id)
+            if was_following:
+                self.me.adjust_following(-1)
         except Exception as e:
             raise RuntimeError(f"Error unfollowing user: {e}")
         
     async def block_user(self, user_id: str):
         """Block a user."""
         try:
+            was_following = self.following.contains(user_id)
             await self.client.block_user(user_id)
+            self.following.discard(user_id)  # Blocking also removes the follow
+            if was_following:
+                self.me.adjust_following(-1)
         except Exception as e:
             raise RuntimeError(f"Error blocking user: {e}")
         
@@ -313,11 +574,56 @@ class TwitterClient:
             await self.client.unblock_user(user_id)
         except Exception as e:
             raise RuntimeError(f"Error unblocking user: {e}")
+
+    async def perform_action(self, action: str, target: str):
+        """Perform one engagement action (see ACTIONS) on a tweet or user ID, waiting for Twitter."""
+        return await getattr(self, ACTIONS[action])(target)
+
+    def enable_write_behind(self, **options):
+        """Acknowledge engagement actions before Twitter has them, see WriteBehindQueue."""
+        self.write_queue = WriteBehindQueue(self, store=self.store, **options)
+        return self.write_queue
+
+    async def run_batch(self, actions: list, max_concurrent: int = 4):
+        """Run many like/bookmark/retweet/follow... actions at once, e.g. [{'action': 'like', 'id': '123'}].
+
+        Actions on different targets run concurrently, at most ``max_concurrent`` at a time.
+        Actions on the same target run in the order given, so 'like' then 'unlike' ends unliked.
+        Returns one result per action, in request order; a failed action doesn't stop the others.
+        With write-behind enabled the actions are queued instead, and each result has its queue status.
+        """
+        results = [None] * len(actions)
+        by_target = {}  # target ID -> [(position, method name)] in request order
+        for position, item in enumerate(actions):
+            action = item.get('action') if isinstance(item, dict) else None
+            target = item.get('id') if isinstance(item, dict) else None
+            if action not in ACTIONS or not target:
+                results[position] = {'action': action, 'id': target, 'ok': False,
+                                     'error': "Each action needs an 'id' and an 'action' of " + ', '.join(ACTIONS)}
+                continue
+            by_target.setdefault(str(target), []).append((position, action))
+
+        limit = asyncio.Semaphore(max_concurrent)
+
+        async def run_target(target, queued):
+            async with limit:
+                for position, action in queued:
+                    try:
+                        if self.write_queue is not None:
+                            entry = await self.write_queue.enqueue(action, target)
+                            results[position] = {'action': action, 'id': target, 'ok': True, 'status': entry['status']}
+                            continue
+                        await self.perform_action(action, target)
+                        results[position] = {'action': action, 'id': target, 'ok': True}
+                    except Exception as e:
+                        results[position] = {'action': action, 'id': target, 'ok': False, 'error': str(e)}
+
+        await asyncio.gather(*(run_target(target, queued) for target, queued in by_target.items()))
+        return results
         
     async def get_user(self):
         try:
-           
-            profile = await self.client.user()
+            profile = await self.me.get(self.client)
             
             return {
             'name': profile.name,
@@ -331,378 +637,322 @@ class TwitterClient:
         except Exception as e:
             raise RuntimeError(f"Error retrieving user: {e}")
         
+    async def fetch_tweet_detail(self, tweet_id):
+        """Fetch and serialize a tweet with its quoted tweet and the tweet it replies to."""
+        tweet = await self.get_tweet_by_id(tweet_id)
+        await self.bookmarks.ensure_fresh(self.client)
+        parent_tweets = await self.fetch_parent_tweets([tweet])
+        return self.serialize([tweet], DETAIL, parents=parent_tweets)[0]
+
     async def get_tweet(self, tweet_id):
         try:
            
-            tweet = await self.client.get_tweet_by_id(tweet_id)
-            
-            tweet_data = {
-            'id': tweet.id,
-            'text': tweet.full_text,
-            'author': tweet.user.name,
-            'username': tweet.user.screen_name,
-            'created_at': tweet.created_at.isoformat() if hasattr(tweet.created_at, 'isoformat') else str(tweet.created_at),
-            'reply_count': tweet.reply_count,
-            'view_count': tweet.view_count,
-            'quote_count': tweet.quote_count,
-            'retweet_count': tweet.retweet_count,
-            'likes_count': tweet.favorite_count,
-            'is_quote': tweet.is_quote_status,
-            'is_liked': tweet.favorited,
-            }
-            
-            #Check if a tweet is quoting another tweet
-            if tweet.is_quote_status == True and tweet.quote is not None:
-                    try:
-                        tweet_data['quoted_tweet'] = {
-                            'id': tweet.quote.id,
-                            'text': tweet.quote.full_text,
-                            'author': tweet.quote.user.name,
-                            'username': tweet.quote.user.screen_name,
-                            'created_at': tweet.quote.created_at.isoformat() if hasattr(tweet.quote.created_at, 'isoformat') else str(tweet.quote.created_at),
-                            'reply_count': tweet.quote.reply_count,
-                            'view_count': tweet.quote.view_count,
-                            'quote_count': tweet.quote.quote_count,
-                            'retweet_count': tweet.quote.retweet_count,
-                            'likes_count': tweet.quote.favorite_count,
-                        }
-                    except Exception as e:
-                        tweet_data['quoted_tweet_error'] = f"Error fetching quoted tweet: {e}"
-            else:
-                    tweet_data['quoted_tweet'] = None  # Ensure this key exists even if no quote
-                    
-            #Handle if a tweet is bookmarked
-            bookmarkedTweets = await self.client.get_bookmarks(count=20)
-            for bookmark in bookmarkedTweets:
-                if tweet.id == bookmark.id:
-                    tweet_data['is_bookmarked'] = True 
-                    print(tweet.id + " " + bookmark.id) 
-                    break
-                else:
-                    tweet_data['is_bookmarked'] = False
-            if tweet.in_reply_to:
-                try:
-                    reply_tweet = await self.client.get_tweet_by_id(tweet.in_reply_to)
-                    tweet_data['reply_to'] = {
-                        'id': reply_tweet.id,
-                        'text': reply_tweet.full_text,
-                        'author': reply_tweet.user.name,
-                        'username': reply_tweet.user.screen_name,
-                        'reply_count': reply_tweet.reply_count,
-                        'view_count': reply_tweet.view_count,
-                        'quote_count': reply_tweet.quote_count,
-                        'retweet_count': reply_tweet.retweet_count,
-                        'likes_count': reply_tweet.favorite_count,
-                        'created_at': reply_tweet.created_at.isoformat() if hasattr(reply_tweet.created_at, 'isoformat') else str(reply_tweet.created_at),
-                    }
-                except Exception as e:
-                        tweet_data['reply_tweet_error'] = f"Error fetching original tweet: {e}"
-            else:
-                    tweet_data['reply_to'] = None  # Ensure this key exists even if no quote
-            
-            
-            if hasattr(tweet, 'media') and tweet.media:
-                    media_urls = [media['media_url_https'] for media in tweet.media if 'media_url_https' in media]
-                    tweet_data['media_urls'] = media_urls  # Add media URLs to the tweet data
-                    
+            tweet_data = await self.cached_read('tweet', tweet_id, lambda: self.fetch_tweet_detail(tweet_id))
+
+            # A stored copy may predate a bookmark change, so always answer from the live index
+            await self.bookmarks.ensure_fresh(self.client)
+            tweet_data['is_bookmarked'] = self.bookmarks.contains(tweet_data['id'])
             return tweet_data
         
         except Exception as e:
             raise RuntimeError(f"Error getting tweet details: {e}")
-
         
     async def get_tweet_context(self, tweet_id):
+        """Fetch a tweet with details, plus every tweet above it in the conversation under 'ancestors'."""
+        tweet_data = dict(await self.get_tweet(tweet_id))
         try:
-           
-            tweet = await self.client.get_tweet_by_id(tweet_id)
-            
-            tweet_data = {
-            'id': tweet.id,
-            'text': tweet.full_text,
-            'author': tweet.user.name,
-            'username': tweet.user.screen_name,
-            'created_at': tweet.created_at.isoformat() if hasattr(tweet.created_at, 'isoformat') else str(tweet.created_at),
-            'reply_count': tweet.reply_count,
-            'view_count': tweet.view_count,
-            'quote_count': tweet.quote_count,
-            'retweet_count': tweet.retweet_count,
-            'likes_count': tweet.favorite_count,
-            'quote': tweet.quote,
-            'in_reply_to': tweet.in_reply_to,
-            'is_liked': tweet.favorited,
-            }
-            
-            
-            
-            # Handle quotes
-            if tweet.is_quote_status == True and tweet.quote is not None:
-                try:
-                    tweet_data['quoted_tweet'] = {
-                            'id': tweet.quote.id,
-                            'text': tweet.quote.full_text,
-                            'author': tweet.quote.user.name,
-                            'username': tweet.quote.user.screen_name,
-                            'created_at': tweet.quote.created_at.isoformat() if hasattr(tweet.quote.created_at, 'isoformat') else str(tweet.quote.created_at),
-                        }
-                except Exception as e:
-                    tweet_data['quoted_tweet_error'] = f"Error fetching quoted tweet: {e}"
-            else:
-                tweet_data['quoted_tweet'] = None  # Ensure this key exists even if no quote
+            ancestors = await self.threads.ancestors(await self.get_tweet_by_id(tweet_id))
+            tweet_data['ancestors'] = self.serialize(ancestors, REPLY)
+        except Exception as e:
+            raise RuntimeError(f"Error fetching tweet context: {e}")
+        return tweet_data
 
+    async def get_more_replies(self, tweet_id: str, cursor: str):
+        """The page of a tweet's replies after ``cursor``, as the twikit Result its replies' next() would fetch."""
+        return await self.coalesced('_get_more_replies', tweet_id, cursor)
 
-            # Handle replies
-            if tweet.in_reply_to:
-                reply_tweet = await self.client.get_tweet_by_id(tweet.in_reply_to)
-                tweet_data['reply_to'] = {
-                    'id': reply_tweet.id,
-                    'text': reply_tweet.full_text,
-                    'author': reply_tweet.user.name,
-                    'username': reply_tweet.user.screen_name,
-                }
-                
-            #Handle if a tweet is bookmarked
-            for bookmark in bookmarkedTweets:
-                if tweet.id == bookmark.id:
-                    tweet_data['is_bookmarked'] = True 
-                    print(tweet.id + " " + bookmark.id) 
-                    break
-                else:
-                    tweet_data['is_bookmarked'] = False
-                    
-            return tweet_data
-        
-        except Exception as e:
-            raise RuntimeError(f"Error getting tweet details: {e}")
-        
-    async def get_replies(self, tweet_id: str, count: int = 20):
-        """Fetch replies to a tweet using the get_tweet_by_id method."""
+    async def get_replies(self, tweet_id: str, count: int = 20, cursor: str = None):
+        """Fetch up to ``count`` direct replies to a tweet; pass the returned next_cursor for more."""
         try:
-            # Fetch the tweet by ID to get replies
-            tweet = await self.client.get_tweet_by_id(tweet_id)
-            
-            # Extract replies from the tweet object
-            replies = tweet.replies  # Assuming tweet.replies contains a list of reply Tweet objects
-            if not replies:
-                raise RuntimeError("No replies found for the tweet.")
-
-            # Serialize replies to a JSON-compatible format
-            serialized_replies = []
-            for reply in replies:
-                reply_data = {
-                    'id': reply.id,
-                    'text': reply.text,
-                    'author': reply.user.name,
-                    'username': reply.user.screen_name,
-                    'created_at': reply.created_at.isoformat() if hasattr(reply.created_at, 'isoformat') else str(reply.created_at),
-                    'reply_count': reply.reply_count,
-                    'view_count': reply.view_count,
-                    'quote_count': reply.quote_count,
-                    'retweet_count': reply.retweet_count,
-                    'likes_count': reply.favorite_count,
-                    'is_liked': reply.favorited,
-                }
-
-                if hasattr(reply, 'media') and reply.media:
-                    media_urls = [media['media_url_https'] for media in reply.media if 'media_url_https' in media]
-                    reply_data['media_urls'] = media_urls  # Add media URLs to the reply data
+            fetch_page = lambda page_cursor: self.get_more_replies(tweet_id, page_cursor)
+            if cursor:
+                replies, last_page = await collect_replies(await fetch_page(cursor), count, fetch_page)
+            else:
+                tweet = await self.get_tweet_by_id(tweet_id)
+                replies, last_page = await collect_replies(tweet.replies, count, fetch_page)
 
-                serialized_replies.append(reply_data)
+            next_cursor = getattr(last_page, 'next_cursor', None)
 
+            await self.bookmarks.ensure_fresh(self.client)
             return {
-                'replies': serialized_replies
+                'replies': self.serialize(replies, REPLY),
+                'next_cursor': next_cursor,
             }
         except Exception as e:
             raise RuntimeError(f"Error fetching replies: {e}")
+
+    async def stream_thread(self, tweet_id: str):
+        """Yield (event, data) pairs for a whole conversation as it is fetched.
+
+        'tweet' carries the tweet itself and 'ancestors' the chain above it, root first.
+        Then one 'level' per depth of replies, each reply with the 'parent_id' it hangs
+        under, and finally 'done' with the size and whether a limit cut the thread short.
+        """
+        tweet = await self.get_tweet_by_id(tweet_id)
+        await self.bookmarks.ensure_fresh(self.client)
+        yield 'tweet', self.serialize([tweet], DETAIL)[0]
+        yield 'ancestors', self.serialize(await self.threads.ancestors(tweet), REPLY)
+
+        state = {}
+        size = 0
+        async for depth, level in self.threads.levels(tweet, state):
+            serialised_replies = [
+                dict(reply_data, parent_id=parent_id)  # A copy, the search index holds the original
+                for (parent_id, _), reply_data in zip(level, self.serialize([reply for _, reply in level], REPLY))
+            ]
+            size += len(level)
+            yield 'level', {'depth': depth, 'tweets': serialised_replies}
+        yield 'done', {'size': size, 'truncated': state['truncated']}
+
+    async def get_thread(self, tweet_id: str):
+        """The whole conversation as a tree: the tweet with nested 'replies', plus its 'ancestors'."""
+        try:
+            thread = {}
+            nodes = {}
+            async for event, data in self.stream_thread(tweet_id):
+                if event == 'tweet':
+                    thread['tweet'] = nodes[data['id']] = dict(data, replies=[])
+                elif event == 'ancestors':
+                    thread['ancestors'] = data
+                elif event == 'level':
+                    for reply_data in data['tweets']:
+                        node = nodes[reply_data['id']] = dict(reply_data, replies=[])
+                        nodes[reply_data['parent_id']]['replies'].append(node)
+                else:
+                    thread.update(data)
+            return thread
+        except Exception as e:
+            raise RuntimeError(f"Error fetching thread: {e}")
         
+    async def fetch_user_profile(self, username, count: int = 20):
+        """Fetch and serialize a user's profile and their latest tweets."""
+        degraded = []
+        # Our own ID only decides is_followable, so ask for it while the profile loads
+        viewer = asyncio.ensure_future(
+            self.branch('viewer', self.client.user_id(), BRANCH_TIMEOUTS['viewer'], degraded)
+        )
+
+        async def tweets(user_id):
+            # Fetched as this account, since is_liked is relative to whoever fetches the tweets
+            user_tweets = await self.client.get_user_tweets(user_id, 'Tweets', count=count)
+            parent_tweets = await self.branch(
+                'parents', self.fetch_parent_tweets(user_tweets), BRANCH_TIMEOUTS['parents'], degraded, default={}
+            )
+            return user_tweets, parent_tweets
+
+        # When we already know the user's ID, their tweets needn't wait for the profile lookup
+        known_id = self.users.id_for(username)
+        early_tweets = asyncio.ensure_future(tweets(known_id)) if known_id else None
+        try:
+            profile = await self.lookup_user(username)
+        except Exception:
+            if early_tweets is not None:
+                early_tweets.cancel()
+            raise
+        if early_tweets is not None and str(profile.id) != known_id:
+            early_tweets.cancel()  # The name belongs to someone else now
+            early_tweets = None
+
+        (user_tweets, parent_tweets), logged_user_id = await asyncio.gather(
+            self.branch('tweets', early_tweets or tweets(profile.id), BRANCH_TIMEOUTS['tweets'], degraded, default=([], {})),
+            viewer,
+        )
+        if not user_tweets and not degraded:
+            raise RuntimeError("Twikit returned no tweets. Check your authentication.")
+
+        # Serialize tweets to a JSON-compatible format
+        serialised_tweets = self.serialize(user_tweets, FEED, parents=parent_tweets)
+        
+        logger.debug("Fetched profile %s with %d tweets", username, len(serialised_tweets))
+        profile_data = {
+        'middleId': profile.id,
+        'middleName': profile.name,
+        'middleUsername': profile.screen_name,
+        'middleFollowers': profile.followers_count,
+        'middleFollowing': profile.following_count,
+        'bio': profile.description,
+        'middleProfileImage': profile.profile_image_url,
+        'bannerUrl': profile.profile_banner_url,
+        'tweets': serialised_tweets
+        }
+        
+        if profile.id == logged_user_id:
+            profile_data['is_followable'] = False
+        else:
+            profile_data['is_followable'] = True
+        if degraded:
+            profile_data['partial'] = sorted(set(degraded))
+        
+        return profile_data
+
     async def get_user_profile(self, username, count: int = 20):
         try:
-            profile = await self.client.get_user_by_screen_name(username, )
-            user_tweets = await profile.get_tweets('Tweets', count=count)
-            if not user_tweets:
-                raise RuntimeError("Twikit returned no tweets. Check your authentication.")
+            degraded = []
+            profile_key = f"{username.lower()}:{count}"
+            # Bookmark and follow state don't depend on the profile, so they load alongside it
+            profile_data, _, _ = await asyncio.gather(
+                self.cached_read('profile', profile_key, lambda: self.fetch_user_profile(username, count)),
+                self.branch('bookmarks', self.bookmarks.ensure_fresh(self.client), BRANCH_TIMEOUTS['bookmarks'], degraded),
+                self.branch('following', self.following.ensure_fresh(self.client), BRANCH_TIMEOUTS['following'], degraded),
+            )
+
+            # Follow and bookmark state come from the live sets, a stored profile may predate them
+            for tweet_data in profile_data['tweets']:
+                tweet_data['is_bookmarked'] = self.bookmarks.contains(tweet_data['id'])
+                if self.store is not None:
+                    profile_keys = self.tweet_profiles.peek(tweet_data['id']) or set()
+                    profile_keys.add(profile_key)
+                    self.tweet_profiles.set(tweet_data['id'], profile_keys)
 
-            print(f"i am in the user replies: {user_tweets}")
-            # Serialize tweets to a JSON-compatible format
-            serialised_tweets = []
-            for tweet in user_tweets:
-                tweet_data = {
-                    'id': tweet.id,
-                    'text': tweet.text,
-                    'author': tweet.user.name,
-                    'created_at': tweet.created_at.isoformat() if hasattr(tweet.created_at, 'isoformat') else str(tweet.created_at),
-                    'is_liked': tweet.favorited,
-                }
-                
-                if tweet.is_quote_status == True and tweet.quote is not None:
-                    try:
-                        tweet_data['quoted_tweet'] = {
-                            'id': tweet.quote.id,
-                            'text': tweet.quote.full_text,
-                            'author': tweet.quote.user.name,
-                            'username': tweet.quote.user.screen_name,
-                            'created_at': tweet.quote.created_at.isoformat() if hasattr(tweet.quote.created_at, 'isoformat') else str(tweet.quote.created_at),
-                        }
-                    except Exception as e:
-                        tweet_data['quoted_tweet_error'] = f"Error fetching quoted tweet: {e}"
-                else:
-                    tweet_data['quoted_tweet'] = None  # Ensure this key exists even if no quote
-                    
-                if tweet.in_reply_to:
-                    reply_tweet = await self.client.get_tweet_by_id(tweet.in_reply_to)
-                    tweet_data['reply_to'] = {
-                        'id': reply_tweet.id,
-                        'text': reply_tweet.full_text,
-                        'author': reply_tweet.user.name,
-                        'username': reply_tweet.user.screen_name,
-                    }
-                
-                #Handle if a tweet is bookmarked
-                for bookmark in bookmarkedTweets:
-                    if tweet.id == bookmark.id:
-                        tweet_data['is_bookmarked'] = True 
-                        print(tweet.id + " " + bookmark.id) 
-                        break
-                    else:
-                        tweet_data['is_bookmarked'] = False
-
-                if hasattr(tweet, 'media') and tweet.media:
-                    media_urls = [media['media_url_https'] for media in tweet.media if 'media_url_https' in media]
-                    tweet_data['media_urls'] = media_urls  # Add media URLs to the tweet data
-
-                serialised_tweets.append(tweet_data)
-            
-            
-            
-            
-            
-            print(f"i am in the user getter: {profile}")
-            profile_data = {
-            'middleId': profile.id,
-            'middleName': profile.name,
-            'middleUsername': profile.screen_name,
-            'middleFollowers': profile.followers_count,
-            'middleFollowing': profile.following_count,
-            'bio': profile.description,
-            'middleProfileImage': profile.profile_image_url,
-            'bannerUrl': profile.profile_banner_url,
-            'tweets': serialised_tweets
-            }
-            
-            loggedUser = await self.client.user()
-            
-            if profile.screen_name == loggedUser.screen_name:
-                profile_data['is_followable'] = False
-            else:
-                profile_data['is_followable'] = True
-            
             #Handle if you follow the user or not
-            profile_followers = await loggedUser.get_following(count=500)
-            for user in profile_followers:
-                if user.screen_name == profile.screen_name:
-                    print(user.screen_name + " = " + profile.screen_name + " MATCH")
-                    profile_data['is_followed'] = True 
-                    break
-                else:
-                    print(user.screen_name + " = " + profile.screen_name + " NO MATCH")
-                    profile_data['is_followed'] = False
+            profile_data['is_followed'] = self.following.contains(profile_data['middleId'])
             
+            if degraded:
+                profile_data['partial'] = sorted(set(profile_data.get('partial', [])) | set(degraded))
             
             return profile_data
         
         except Exception as e:
-            print(f"there is an error with the users {e}")
             raise RuntimeError(f"Error fetching user profile: {e}")
 
-    async def get_chat_history(self, user_id):
-        """Fetch the chat history with a specific user."""
+    async def name_senders(self, user_id, messages: list) -> list:
+        """Copies of serialized messages with each sender's screen name, looked up only the first time."""
+        names = await self.resolve_users(user_ids=[str(user_id), await self.client.user_id()])
+        return [dict(message, sender_username=names['usernames'].get(message['sender'])) for message in messages]
+
+    async def get_chat_history(self, user_id, before: str = None, count: int = 50):
+        """Fetch a page of the chat history with a specific user, newest first.
+
+        Without ``before``, only messages newer than the ones we already hold are fetched.
+        With it, the page continues back from that message ID. Returns {'messages', 'next_cursor'}.
+        """
         try:
-            messages = await self.client.get_dm_history(user_id=user_id)
-            print(f"i am in the user DMs: {user_id}")
-            return [{'sender': msg.id, 'text': msg.text} for msg in messages]
+            user_id = str(user_id)
+            if before:
+                messages = await self.dms.older(self.client, user_id, before, count)
+            else:
+                conversation = await self.dms.sync(self.client, user_id)
+                messages = conversation.messages[:count]
+            conversation = await self.dms.conversation(user_id)
+            messages = await self.name_senders(user_id, messages)
+
+            at_start = conversation.reached_start and messages and messages[-1]['id'] == conversation.oldest_id
+            next_cursor = messages[-1]['id'] if messages and not at_start else None
+            return {'messages': messages, 'next_cursor': next_cursor}
         except Exception as e:
             raise RuntimeError(f"Error fetching chat history: {e}")
 
     async def send_message(self, user_id, text):
-        """Send a message to a specific user."""
+        """Send a message to a specific user and add it to the local conversation."""
         try:
-            await self.client.send_dm(user_id=user_id, text=text)
+            user_id = str(user_id)
+            message = await self.client.send_dm(user_id=user_id, text=text)
+            # twikit guesses the sender from the order of the users in the response; we know better
+            message_data = serialize_message(message, sender_id=await self.client.user_id(), recipient_id=user_id)
+            await self.dms.append(user_id, message_data)
+            message_data = dict(message_data, sender_username=self.users.name_for(message_data['sender']))
+            self.dm_stream.publish({'user_id': user_id, 'messages': [message_data]})  # Other open tabs show it too
+            return message_data
         except Exception as e:
             raise RuntimeError(f"Error sending message: {e}")
-        
+
+    def watch_conversation(self, user_id):
+        """Include a conversation in the live DM poll until every watcher has called unwatch_conversation()."""
+        user_id = str(user_id)
+        self.watched_conversations[user_id] = self.watched_conversations.get(user_id, 0) + 1
+
+    def unwatch_conversation(self, user_id):
+        user_id = str(user_id)
+        remaining = self.watched_conversations.get(user_id, 0) - 1
+        if remaining > 0:
+            self.watched_conversations[user_id] = remaining
+        else:
+            self.watched_conversations.pop(user_id, None)
+
+    async def poll_new_messages(self) -> list:
+        """Check every watched conversation once for new messages.
+
+        Returns one {'user_id', 'messages'} event per conversation that has any, however many
+        tabs are watching it.
+        """
+        user_ids = list(self.watched_conversations)
+        with priority(BACKGROUND):
+            results = await asyncio.gather(
+                *(self.dms.poll(self.client, user_id) for user_id in user_ids), return_exceptions=True,
+            )
+        events = []
+        for user_id, new_messages in zip(user_ids, results):
+            if isinstance(new_messages, Exception):
+                logger.warning("Error polling DMs with %s: %s", user_id, new_messages)
+            elif new_messages:
+                events.append({'user_id': user_id, 'messages': await self.name_senders(user_id, new_messages)})
+        return events
+
     async def get_user_id(self, username):
         """Fetch the user_id for a given username."""
         try:
-            user = await self.client.get_user_by_screen_name(username)
-            print(f"i am in the user DMs: {user.id}")
-            return user.id
+            return await self.resolve_user_id(username)
         except Exception as e:
             raise RuntimeError(f"Error fetching user ID: {e}")
         
-    async def search_twitter(self, query):
+    def search_local(self, query, limit: int = 20):
+        """Search the tweets we've already served, ranked, without spending any rate limit."""
+        serialised_tweets = []
+        for tweet_data in self.search_index.search(query, limit=limit):
+            tweet_data = dict(tweet_data)  # Don't touch the indexed copy
+            tweet_data['is_bookmarked'] = self.bookmarks.contains(tweet_data['id'])
+            serialised_tweets.append(tweet_data)
+        return {
+            'user_results': [],
+            'tweet_results': serialised_tweets
+        }
+
+    async def search_twitter(self, query, mode: str = 'remote'):
+        """Search tweets and users. ``mode`` is 'remote' (Twitter), 'local' (our index) or 'hybrid' (both)."""
+        if mode == 'local':
+            return self.search_local(query)
         try:
-            bookmarkedTweets = await self.client.get_bookmarks(count=20)
-            
-            user_list = await self.client.search_user(query, count=3)
-            search_result = await self.client.search_tweet(query=query, count=10,product='Top')
-            
+            degraded = []
 
+            async def tweets():
+                search_result = await self.client.search_tweet(query=query, count=10,product='Top')
+                parent_tweets = await self.branch(
+                    'parents', self.fetch_parent_tweets(search_result), BRANCH_TIMEOUTS['parents'], degraded, default={}
+                )
+                return search_result, parent_tweets
+
+            async def users():
+                user_list = await self.pooled('search_user', query, count=3)
+                self.users.remember_many(user_list)
+                logged_user_id = None
+                if user_list:
+                    # Only needed to mark the users found, so only asked for once there are some
+                    logged_user_id, _ = await asyncio.gather(
+                        self.branch('viewer', self.client.user_id(), BRANCH_TIMEOUTS['viewer'], degraded),
+                        self.branch('following', self.following.ensure_fresh(self.client), BRANCH_TIMEOUTS['following'], degraded),
+                    )
+                return user_list, logged_user_id
+
+            # Tweets are the page; users, bookmark state and reply parents can be left out if they're slow
+            (search_result, parent_tweets), (user_list, logged_user_id), _ = await asyncio.gather(
+                tweets(),
+                self.branch('users', users(), BRANCH_TIMEOUTS['users'], degraded, default=([], None)),
+                self.branch('bookmarks', self.bookmarks.ensure_fresh(self.client), BRANCH_TIMEOUTS['bookmarks'], degraded),
+            )
 
-            print(f"i am in the search tweets results: {search_result}")
             # Serialize tweets to a JSON-compatible format
-            serialised_tweets = []
-            for tweet in search_result:
-                tweet_data = {
-                    'id': tweet.id,
-                    'text': tweet.text,
-                    'author': tweet.user.name,
-                    'created_at': tweet.created_at.isoformat() if hasattr(tweet.created_at, 'isoformat') else str(tweet.created_at),
-                    'is_liked': tweet.favorited,
-                }
-                
-                if tweet.is_quote_status == True and tweet.quote is not None:
-                    try:
-                        tweet_data['quoted_tweet'] = {
-                            'id': tweet.quote.id,
-                            'text': tweet.quote.full_text,
-                            'author': tweet.quote.user.name,
-                            'username': tweet.quote.user.screen_name,
-                            'created_at': tweet.quote.created_at.isoformat() if hasattr(tweet.quote.created_at, 'isoformat') else str(tweet.quote.created_at),
-                        }
-                    except Exception as e:
-                        tweet_data['quoted_tweet_error'] = f"Error fetching quoted tweet: {e}"
-                else:
-                    tweet_data['quoted_tweet'] = None  # Ensure this key exists even if no quote
-                    
-                if tweet.in_reply_to:
-                    reply_tweet = await self.client.get_tweet_by_id(tweet.in_reply_to)
-                    tweet_data['reply_to'] = {
-                        'id': reply_tweet.id,
-                        'text': reply_tweet.full_text,
-                        'author': reply_tweet.user.name,
-                        'username': reply_tweet.user.screen_name,
-                    }
-
-                if hasattr(tweet, 'media') and tweet.media:
-                    media_urls = [media['media_url_https'] for media in tweet.media if 'media_url_https' in media]
-                    tweet_data['media_urls'] = media_urls  # Add media URLs to the tweet data
-                    
-                #Handle if a tweet is bookmarked
-                for bookmark in bookmarkedTweets:
-                    if tweet.id == bookmark.id:
-                        print(f"TWEET IS BOOKMARKED in search results")
-                        tweet_data['is_bookmarked'] = True 
-                        print(tweet.id + " " + bookmark.id) 
-                        break
-                    else:
-                        tweet_data['is_bookmarked'] = False
-
-                serialised_tweets.append(tweet_data)
-            
-            
+            serialised_tweets = self.serialize(search_result, FEED, parents=parent_tweets)
             
-            
-            
-            print(f"i am in the user results: {user_list}")
             serialised_users = []
             for profile in user_list:
                 profile_data = {
@@ -712,32 +962,32 @@ class TwitterClient:
                 'searchResultProfileImage': profile.profile_image_url,
                 }
                 
-                loggedUser = await self.client.user()
-                
-                if profile.screen_name == loggedUser.screen_name:
+                if profile.id == logged_user_id:
                     profile_data['is_followable'] = False
                 else:
                     profile_data['is_followable'] = True
                 
                 #Handle if you follow the user or not
-                profile_followers = await loggedUser.get_following(count=500)
-                for user in profile_followers:
-                    if user.screen_name == profile.screen_name:
-                        print(user.screen_name + " = " + profile.screen_name + " MATCH")
-                        profile_data['is_followed'] = True 
-                        break
-                    else:
-                        print(user.screen_name + " = " + profile.screen_name + " NO MATCH")
-                        profile_data['is_followed'] = False
+                profile_data['is_followed'] = self.following.contains(profile.id)
                 serialised_users.append(profile_data)
             
-            print(f"searching twitter with query: " + query)
+            logger.debug("Search %r (%s): %d users, %d tweets", query, mode, len(serialised_users), len(serialised_tweets))
+
+            # Hybrid: follow Twitter's results with anything else we've seen that matches
+            if mode == 'hybrid':
+                remote_ids = {tweet_data['id'] for tweet_data in serialised_tweets}
+                serialised_tweets += [
+                    tweet_data for tweet_data in self.search_local(query)['tweet_results']
+                    if tweet_data['id'] not in remote_ids
+                ]
             
-            return {
+            results = {
                 'user_results': serialised_users,
                 'tweet_results': serialised_tweets
             }
+            if degraded:
+                results['partial'] = sorted(set(degraded))
+            return results
         
         except Exception as e:
-            print(f"there is an error with the users {e}")
             raise RuntimeError(f"Error fetching user profile: {e}")
\ No newline at end of file
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import random
+import time
+
+from twikit.errors import TooManyRequests
+
+from scheduler import RateLimited
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+# Actions that undo each other; queuing one while the other is still pending cancels both
+INVERSES = {
+    'like': 'unlike', 'unlike': 'like',
+    'bookmark': 'unbookmark', 'unbookmark': 'bookmark',
+    'follow': 'unfollow', 'unfollow': 'follow',
+    'block': 'unblock', 'unblock': 'block',
+}
+
+
+def retry_after(error) -> float:
+    """Seconds until a rate-limited action may be retried, or None if it wasn't rate limited."""
+    while error is not None:
+        if isinstance(error, RateLimited):
+            return error.retry_after
+        if isinstance(error, TooManyRequests):
+            reset = getattr(error, 'rate_limit_reset', None)
+            return max(1.0, reset - time.time()) if reset else 15 * 60
+        error = error.__cause__ or error.__context__
+    return None
+
+
+class WriteBehindQueue:
+    """Durable queue of engagement actions that are acknowledged before Twitter sees them.
+
+    ``enqueue`` applies the action's local state straight away (bookmark index, following
+    set, cached tweets) and records it. A background worker then performs the queued
+    actions through the TwitterClient. Failures are retried with exponential backoff, or
+    after the reported reset when rate limited. An action that still fails after
+    ``max_attempts`` tries is marked failed and its local state is rolled back. Actions on
+    the same target reach Twitter in the order they were queued, retries included.
+
+    Entries are keyed by an idempotency key, which defaults to "<action>:<id>". Queuing the
+    same key again while it is pending, or after it succeeded, returns the existing entry
+    instead of liking twice. With a Store, entries survive restarts: ``enqueue`` only
+    returns once the entry is on disk.
+    """
+
+    def __init__(self, client, store=None, max_attempts: int = 5, base_delay: float = 2,
+                 max_delay: float = 300, max_concurrent: int = 4, keep_done_for: float = 60 * 60):
+        self.client = client
+        self.store = store
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_concurrent = max_concurrent
+        self.keep_done_for = keep_done_for  # Finished entries are kept this long for dedup and status
+        self._entries = {}  # idempotency key -> entry dict, in the order they were queued
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._in_flight = set()  # Keys of the entries being sent to Twitter right now
+
+    def _save(self, entry: dict):
+        """Write an entry to the store in the background; returns the task, or None without a store."""
+        if self.store is not None:
+            return self.client.spawn(self.store.put('write', entry['key'], entry))
+
+    def _drop(self, key: str):
+        self._entries.pop(key, None)
+        if self.store is not None:
+            return self.client.spawn(self.store.delete('write', key))
+
+    async def load(self):
+        """Pick up the entries a previous run left behind."""
+        if self.store is None:
+            return
+        for key, entry in await self.store.items('write'):
+            if entry.get('status') == PENDING:
+                entry['next_attempt_at'] = 0  # Retry straight away after a restart
+            self._entries[key] = entry
+        self._prune()
+        self._wakeup.set()
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_done_for
+        for key, entry in list(self._entries.items()):
+            if entry['status'] == DONE and entry['updated_at'] < cutoff:
+                self._drop(key)
+
+    def _find(self, action: str, target: str, statuses: tuple):
+        for entry in self._entries.values():
+            if entry['action'] == action and entry['id'] == target and entry['status'] in statuses:
+                return entry
+        return None
+
+    def _apply_locally(self, action: str, target: str):
+        """What the action would do to our local state once it succeeds, applied up front."""
+        if action in ('bookmark', 'unbookmark', 'like', 'unlike', 'retweet'):
+            self.client.invalidate_tweet(target)
+        if action in ('like', 'unlike'):
+            self.client.mark_liked(target, action == 'like')
+        elif action == 'bookmark':
+            self.client.bookmarks.add(target)
+        elif action == 'unbookmark':
+            self.client.bookmarks.discard(target)
+        elif action == 'follow':
+            if not self.client.following.contains(target):
+                self.client.me.adjust_following(+1)
+            self.client.following.add(target)
+        elif action in ('unfollow', 'block'):
+            if self.client.following.contains(target):
+                self.client.me.adjust_following(-1)
+            self.client.following.discard(target)
+
+    def _roll_back(self, action: str, target: str):
+        inverse = INVERSES.get(action)
+        if inverse in ('bookmark', 'unbookmark', 'follow', 'unfollow', 'like', 'unlike'):
+            self._apply_locally(inverse, target)
+        elif action == 'retweet':
+            self.client.invalidate_tweet(target)
+
+    async def enqueue(self, action: str, target: str, key: str = None) -> dict:
+        """Queue an action and return its entry; the caller can answer the user right away."""
+        target = str(target)
+        key = key or f"{action}:{target}"
+        existing = self._entries.get(key)
+        if existing is not None and existing['status'] in (PENDING, DONE):
+            return existing
+
+        writes = []  # Store writes to finish before acknowledging, so the answer survives a crash
+        inverse = INVERSES.get(action)
+        if inverse is not None:
+            pending_inverse = self._find(inverse, target, (PENDING,))
+            if pending_inverse is not None and pending_inverse['attempts'] == 0 and pending_inverse['key'] not in self._in_flight:
+                # e.g. like then unlike before the like went out: neither needs to reach Twitter
+                writes.append(self._drop(pending_inverse['key']))
+                self._apply_locally(action, target)
+                await self._flush(writes)
+                return {'key': key, 'action': action, 'id': target, 'status': DONE, 'cancelled': pending_inverse['key']}
+            # The inverse has gone through, so its key must not block it happening again later
+            finished_inverse = self._find(inverse, target, (DONE, FAILED))
+            if finished_inverse is not None:
+                writes.append(self._drop(finished_inverse['key']))
+        if existing is not None:
+            writes.append(self._drop(key))  # A failed entry is replaced by the new attempt
+        # Already queued or done under another key, and not undone since
+        duplicate = self._find(action, target, (PENDING, DONE))
+        if duplicate is not None:
+            await self._flush(writes)
+            return duplicate
+
+        now = time.time()
+        entry = {
+            'key': key,
+            'action': action,
+            'id': target,
+            'status': PENDING,
+            'attempts': 0,
+            'error': None,
+            'created_at': now,
+            'updated_at': now,
+            'next_attempt_at': 0,
+        }
+        self._entries[key] = entry
+        self._apply_locally(action, target)
+        writes.append(self._save(entry))
+        self._wakeup.set()
+        self.start()
+        await self._flush(writes)
+        return entry
+
+    @staticmethod
+    async def _flush(writes: list):
+        """Wait for the given store writes; the first failure is raised once they have all finished.
+
+        The action stays queued in memory either way, so retrying with the same key is safe.
+        """
+        results = await asyncio.gather(*(write for write in writes if write is not None), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise RuntimeError(f"Queued, but couldn't save the queue to disk: {result}") from result
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def _due(self, now: float) -> list:
+        """Pending entries that may go now. An entry waits while an older one for its target is
+        still pending, so a like backing off after a failure can't land after the unlike queued behind it."""
+        due = []
+        blocked = set()  # Targets whose oldest pending entry isn't due yet
+        for entry in self._entries.values():
+            if entry['status'] != PENDING or entry['id'] in blocked:
+                continue
+            if entry['next_attempt_at'] <= now:
+                due.append(entry)
+            else:
+                blocked.add(entry['id'])
+        return due
+
+    def _next_attempt_at(self) -> float:
+        """When the earliest blocked target's oldest pending entry is due, or None if nothing is pending."""
+        heads = {}
+        for entry in self._entries.values():
+            if entry['status'] == PENDING:
+                heads.setdefault(entry['id'], entry['next_attempt_at'])
+        return min(heads.values()) if heads else None
+
+    async def _perform(self, entry: dict):
+        if self._entries.get(entry['key']) is not entry or entry['status'] != PENDING:
+            return  # Cancelled by its inverse while waiting for its turn
+        self._in_flight.add(entry['key'])
+        try:
+            await self.client.perform_action(entry['action'], entry['id'])
+        except Exception as e:
+            entry['attempts'] += 1
+            entry['error'] = str(e)
+            wait = retry_after(e)
+            if wait is None and entry['attempts'] >= self.max_attempts:
+                entry['status'] = FAILED
+                self._roll_back(entry['action'], entry['id'])
+                logger.warning("Giving up on %s %s after %d attempts: %s",
+                               entry['action'], entry['id'], entry['attempts'], e)
+            else:
+                if wait is None:
+                    wait = min(self.max_delay, self.base_delay * 2 ** (entry['attempts'] - 1))
+                    wait *= random.uniform(0.8, 1.2)
+                entry['next_attempt_at'] = time.time() + wait
+                logger.info("Retrying %s %s in %.0fs: %s", entry['action'], entry['id'], wait, e)
+        else:
+            entry['status'] = DONE
+            entry['error'] = None
+        finally:
+            self._in_flight.discard(entry['key'])
+        entry['updated_at'] = time.time()
+        if self._entries.get(entry['key']) is entry:  # Not cancelled or replaced meanwhile
+            self._save(entry)
+
+    async def _run(self):
+        limit = asyncio.Semaphore(self.max_concurrent)
+
+        async def perform_in_order(entries):
+            async with limit:
+                for entry in entries:
+                    await self._perform(entry)
+                    if entry['status'] == PENDING:
+                        break  # Backing off: later entries for this target wait behind it
+
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            due = self._due(now)
+            if due:
+                # Same target in queue order, different targets in parallel
+                by_target = {}
+                for entry in due:
+                    by_target.setdefault(entry['id'], []).append(entry)
+                await asyncio.gather(*(perform_in_order(entries) for entries in by_target.values()))
+                self._prune()
+                continue
+
+            next_attempt_at = self._next_attempt_at()
+            if next_attempt_at is None:
+                await self._wakeup.wait()
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, next_attempt_at - now))
+            except asyncio.TimeoutError:
+                pass
+
+    def retry(self, key: str):
+        """Queue a failed entry again, resetting its attempts. Returns the entry, or None."""
+        entry = self._entries.get(key)
+        if entry is None or entry['status'] != FAILED:
+            return None
+        entry.update(status=PENDING, attempts=0, next_attempt_at=0, updated_at=time.time())
+        self._apply_locally(entry['action'], entry['id'])
+        self._save(entry)
+        self._wakeup.set()
+        self.start()
+        return entry
+
+    def status(self) -> dict:
+        entries = list(self._entries.values())
+        return {
+            status: [entry for entry in entries if entry['status'] == status]
+            for status in (PENDING, FAILED, DONE)
+        }